@@ -146,7 +146,7 @@ async def hf_embed(texts: list[str], tokenizer, embed_model) -> np.ndarray:
     ).to(device)
 
     # Perform inference
-    with torch.no_grad():
+    with torch.inference_mode():
         outputs = embed_model(
             input_ids=encoded_texts["input_ids"],
             attention_mask=encoded_texts["attention_mask"],
@@ -14,7 +14,8 @@ from local_models import (
     show_oss_config,
     show_embedding_config,
     enable_remote_embedding,
-    disable_remote_embedding
+    disable_remote_embedding,
+    closing_sessions
 )
 
 async def insert_text(rag, file_path):
@@ -105,4 +106,4 @@ async def main():
         print("请先运行 Step_0.py 来处理数据集")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(closing_sessions(main()))
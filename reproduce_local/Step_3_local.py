@@ -9,7 +9,8 @@ from local_models import (
     lightrag_llm_func_async, 
     lightrag_embedding_func_async, 
     get_embedding_dim,
-    init_qwen_embedding
+    init_qwen_embedding,
+    closing_sessions
 )
 
 def extract_queries(file_path):
@@ -154,4 +155,4 @@ async def main():
             traceback.print_exc()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(closing_sessions(main()))
@@ -3,10 +3,210 @@ import json
 import random
 import os
 import re
-from local_models import lightrag_llm_func_async
+import aiofiles
+import tiktoken
+from dataclasses import dataclass
+from local_models import lightrag_llm_func_async, closing_sessions
+
+# 评判结果关键词（预编译，忽略大小写）
+_JUDGE_A_RE = re.compile(r"答案a|选择a|a更好|a比较好", re.IGNORECASE)
+_JUDGE_B_RE = re.compile(r"答案b|选择b|b更好|b比较好", re.IGNORECASE)
+
+# 评判调用重试配置（指数退避 + 抖动）
+JUDGE_MAX_RETRIES = 5
+JUDGE_BACKOFF_BASE = 1.0
+JUDGE_BACKOFF_CAP = 30.0
+# 限流(429)或服务端过载(5xx)时需要更长的退避
+_OVERLOADED_RE = re.compile(r"\b(?:429|5\d\d)\b|rate.?limit|too many requests", re.IGNORECASE)
+# 所有评判调用共享的并发上限
+JUDGE_MAX_CONCURRENCY = 4
+_judge_semaphore = asyncio.Semaphore(JUDGE_MAX_CONCURRENCY)
+
+async def retrying_judge(prompt, **kwargs):
+    """带指数退避和抖动的评判调用，重试耗尽后抛出RuntimeError"""
+    for attempt in range(JUDGE_MAX_RETRIES):
+        try:
+            async with _judge_semaphore:
+                result = await lightrag_llm_func_async(prompt, **kwargs)
+            # oss_llm_complete_async 以 "Error: ..." 字符串形式返回失败
+            if not result.startswith("Error:"):
+                return result
+            error_message = result
+        except Exception as e:
+            error_message = f"{type(e).__name__}: {e}"
+        
+        if attempt == JUDGE_MAX_RETRIES - 1:
+            raise RuntimeError(f"评判调用重试{JUDGE_MAX_RETRIES}次后仍失败: {error_message}")
+        
+        if _OVERLOADED_RE.search(error_message):
+            wait = min(JUDGE_BACKOFF_CAP, JUDGE_BACKOFF_BASE * 2 ** attempt) + random.uniform(0, JUDGE_BACKOFF_BASE)
+        else:
+            # 瞬时网络错误，短暂等待即可
+            wait = random.uniform(0, JUDGE_BACKOFF_BASE)
+        print(f"  ⏳ 评判调用失败，{wait:.1f}秒后重试 ({attempt + 1}/{JUDGE_MAX_RETRIES}): {error_message[:100]}")
+        await asyncio.sleep(wait)
+
+# 评判提示词模板
+JUDGE_PROMPT_TEMPLATE = """
+请评判以下两个答案哪个更好地回答了问题。请从准确性、完整性、清晰度等方面进行评估：
+
+问题：{question}
+
+答案A：{answer_a}
+
+答案B：{answer_b}
+
+请选择更好的答案（A或B）并简要说明理由：
+"""
+
+LENGTH_JUDGE_PROMPT_TEMPLATE = """
+请评判以下两个答案哪个更好地回答了问题：
+
+问题：{question}
+
+答案A：{answer_a}
+
+答案B：{answer_b}
+
+请选择更好的答案（A或B）并简要说明理由：
+"""
+
+PREFERENCE_PROMPT_TEMPLATE = """
+请评判以下两个RAG系统回答哪个更好：
+
+问题：{question}
+
+Hybrid模式回答：{hybrid_answer}
+
+Naive模式回答：{naive_answer}
+
+请选择更好的回答（Hybrid或Naive）并说明理由：
+"""
+
+# 长度偏置测试只选长度差异显著的答案对，单位是cl100k token。
+# 原先按字符数取100；英文答案约4个字符一个token，换算后约25个token，保持筛选范围不变
+LENGTH_DIFF_THRESHOLD_TOKENS = 25
+
+# 位置偏置等确定性评判使用的温度
+JUDGE_TEMPERATURE = 0.1
+
+async def _run_sequentially(*coros):
+    """依次执行多个协程，用于有先后依赖的测试"""
+    for coro in coros:
+        await coro
+
+# 批量评判：每次调用打包的评判条数
+JUDGE_BATCH_SIZE = 8
+
+# 试次偏置测试：抽取的答案对数和每对的试验次数
+TRIAL_PAIRS = 5
+TRIALS_PER_PAIR = 3
+
+BATCH_JUDGE_PROMPT_HEADER = """
+以下有{count}组相互独立的评判任务，每组包含一个问题和两个答案（答案A和答案B）。
+请从准确性、完整性、清晰度等方面逐一判断每组中哪个答案更好，各组之间互不影响。
+
+只输出一个JSON数组，每组对应一个元素，不要输出其他内容，格式如下：
+[{{"pair_id": 0, "choice": "A"}}, {{"pair_id": 1, "choice": "B"}}]
+"""
+
+BATCH_JUDGE_ITEM_TEMPLATE = """问题：{question}
+
+答案A：{answer_a}
+
+答案B：{answer_b}
+"""
+
+def _split_template(template, fields):
+    """按占位符顺序把模板切分为字面量片段，避免每次调用都重新解析format"""
+    fragments = []
+    rest = template
+    for field in fields:
+        head, rest = rest.split("{" + field + "}", 1)
+        fragments.append(head)
+    fragments.append(rest)
+    return tuple(fragments)
+
+def _render(frags, q, a, b):
+    """将问题和两个答案填入预切分的模板片段"""
+    return f"{frags[0]}{q}{frags[1]}{a}{frags[2]}{b}{frags[3]}"
+
+@dataclass
+class PositionSummary:
+    """位置偏置统计"""
+    total: int = 0
+    consistent: int = 0
+    
+    @property
+    def consistency_rate(self):
+        return self.consistent / self.total if self.total else 0
+
+@dataclass
+class LengthSummary:
+    """长度偏置统计（每个答案对包含两次评判）"""
+    total_pairs: int = 0
+    chose_longer: int = 0
+    
+    @property
+    def longer_preference(self):
+        total_tests = self.total_pairs * 2
+        return self.chose_longer / total_tests if total_tests else 0.5
+
+@dataclass
+class TrialSummary:
+    """试次偏置统计"""
+    total_pairs: int = 0
+    biased_pairs: int = 0
+    rated_pairs: int = 0  # 有效试次足够、计算了一致性的答案对
+    consistency_sum: float = 0.0
+    
+    @property
+    def avg_consistency(self):
+        return self.consistency_sum / self.rated_pairs if self.rated_pairs else None
+
+@dataclass
+class PreferenceSummary:
+    """模式偏好统计"""
+    total: int = 0
+    hybrid: int = 0
+    naive: int = 0
+
+def _summarize_position(data):
+    summary = PositionSummary()
+    for item in data:
+        summary.total += 1
+        summary.consistent += item["consistent"]
+    return summary
+
+def _summarize_length(data):
+    summary = LengthSummary()
+    for item in data:
+        summary.total_pairs += 1
+        summary.chose_longer += item["chose_longer_when_short_first"] + item["chose_longer_when_long_first"]
+    return summary
+
+def _summarize_trial(data):
+    summary = TrialSummary()
+    for item in data:
+        summary.total_pairs += 1
+        summary.biased_pairs += item.get("has_trial_bias", False)
+        if "consistency_rate" in item:
+            summary.rated_pairs += 1
+            summary.consistency_sum += item["consistency_rate"]
+    return summary
+
+def _summarize_preference(data):
+    summary = PreferenceSummary()
+    for item in data:
+        summary.total += 1
+        if item["choice"] == "hybrid":
+            summary.hybrid += 1
+        elif item["choice"] == "naive":
+            summary.naive += 1
+    return summary
 
 class JudgeBiasAnalyzer:
-    def __init__(self):
+    def __init__(self, seed=42, partial_dir=None, trial_temperature=0.3, reuse_position_cache=True):
         self.results = {
             "position_bias": [],
             "length_bias": [],
@@ -16,6 +216,48 @@ class JudgeBiasAnalyzer:
         self.questions = []
         self.hybrid_answers = {}
         self.naive_answers = {}
+        # 答案长度按token计算，加载时每个答案只编码一次
+        self._tok = tiktoken.get_encoding("cl100k_base")
+        self.hybrid_tokens = {}
+        self.naive_tokens = {}
+        self.summaries = {}
+        # 固定随机种子，保证试次偏置的抽样和答案顺序在重复运行时一致
+        self._rng = random.Random(seed)
+        # 每项测试的单条结果会实时追加到 partial_dir 下的jsonl分片，中途失败时已完成的结果不会丢失；
+        # 重新运行时读回分片，跳过已完成的答案对
+        self.partial_dir = partial_dir
+        self._resumed = {name: {} for name in self.results}  # 测试名 -> {pair_id: 已完成的记录}
+        # 试次偏置测试与位置偏置测试温度相同时，复用位置偏置的两次评判作为其中两次试验。
+        # 只复用用单条评判模板(JUDGE_PROMPT_TEMPLATE)得到的结果：批量提示词的格式不同，
+        # 与单条评判的试验混在一起计算一致性就不是同一个评判条件了
+        self.trial_temperature = trial_temperature
+        self.reuse_position_cache = reuse_position_cache
+        self._position_choices = {}  # (pair_id, order) -> 原始选择（仅单条评判模板的结果）
+        self._trial_plan = None  # 试次偏置测试的(抽样下标, 每次试验的答案顺序)，见_trial_sample
+        
+        # 预切分评判模板
+        self._judge_frags = _split_template(JUDGE_PROMPT_TEMPLATE, ("question", "answer_a", "answer_b"))
+        self._length_judge_frags = _split_template(LENGTH_JUDGE_PROMPT_TEMPLATE, ("question", "answer_a", "answer_b"))
+        self._preference_frags = _split_template(PREFERENCE_PROMPT_TEMPLATE, ("question", "hybrid_answer", "naive_answer"))
+        self._batch_item_frags = _split_template(BATCH_JUDGE_ITEM_TEMPLATE, ("question", "answer_a", "answer_b"))
+    
+    def _trial_sample(self, answer_pairs):
+        """试次偏置测试抽取的答案对下标和每次试验的答案顺序。
+        首次调用时抽样，之后复用：位置偏置测试在复用模式下要提前知道哪些答案对会被抽中"""
+        if self._trial_plan is None:
+            sampled_indices = self._rng.sample(range(len(answer_pairs)), min(TRIAL_PAIRS, len(answer_pairs)))
+            # 预先随机决定每次试验的答案顺序（避免位置偏置影响试次偏置测试）
+            trial_orders = [
+                ["hybrid_first" if self._rng.random() < 0.5 else "naive_first" for _ in range(TRIALS_PER_PAIR)]
+                for _ in sampled_indices
+            ]
+            self._trial_plan = (sampled_indices, trial_orders)
+        return self._trial_plan
+    
+    @property
+    def reuses_position_verdicts(self):
+        """试次偏置测试是否复用位置偏置测试的评判结果"""
+        return self.reuse_position_cache and self.trial_temperature == JUDGE_TEMPERATURE
     
     def load_real_data(self, results_dir, questions_file):
         """加载真实的问题和答案数据"""
@@ -47,11 +289,13 @@ class JudgeBiasAnalyzer:
                         query = item.get("query", "")
                         result = item.get("result", "")
                         self.hybrid_answers[query] = result
+                        self.hybrid_tokens[query] = len(self._tok.encode(result))
                 elif mode == "naive":
                     for item in data:
                         query = item.get("query", "")
                         result = item.get("result", "")
                         self.naive_answers[query] = result
+                        self.naive_tokens[query] = len(self._tok.encode(result))
                 
                 print(f"✅ 加载了 {mode} 模式的 {len(data)} 个答案")
                 
@@ -74,21 +318,25 @@ class JudgeBiasAnalyzer:
             for query, answer in self.hybrid_answers.items():
                 if question in query or self._questions_match(question, query):
                     hybrid_answer = answer
+                    hybrid_tokens = self.hybrid_tokens[query]
                     break
             
             # 在naive答案中查找匹配的问题  
             for query, answer in self.naive_answers.items():
                 if question in query or self._questions_match(question, query):
                     naive_answer = answer
+                    naive_tokens = self.naive_tokens[query]
                     break
             
             # 如果两个模式都有答案，添加到答案对中
             if hybrid_answer and naive_answer:
-                length_diff = abs(len(hybrid_answer) - len(naive_answer))
+                length_diff = abs(hybrid_tokens - naive_tokens)
                 answer_pairs.append({
                     "question": question,
                     "hybrid_answer": hybrid_answer,
                     "naive_answer": naive_answer,
+                    "hybrid_tokens": hybrid_tokens,
+                    "naive_tokens": naive_tokens,
                     "length_diff": length_diff
                 })
         
@@ -116,105 +364,115 @@ class JudgeBiasAnalyzer:
     async def test_position_bias_hybrid_naive(self, answer_pairs):
         """测试Hybrid vs Naive的位置偏置"""
         
-        judge_prompt_template = """
-请评判以下两个答案哪个更好地回答了问题。请从准确性、完整性、清晰度等方面进行评估：
-
-问题：{question}
-
-答案A：{answer_a}
-
-答案B：{answer_b}
-
-请选择更好的答案（A或B）并简要说明理由：
-"""
+        # 上次运行已完成的答案对直接沿用
+        resumed = self._resumed["position_bias"]
+        position_bias_results = list(resumed.values())
+        pending = [(pair_idx, pair) for pair_idx, pair in enumerate(answer_pairs) if pair_idx not in resumed]
         
-        position_bias_results = []
+        print(f"开始测试所有 {len(answer_pairs)} 个答案对的位置偏置（{len(resumed)} 个已完成）...")
         
-        print(f"开始测试所有 {len(answer_pairs)} 个答案对的位置偏置...")
+        raw_choices = {}
         
-        for pair_idx, pair in enumerate(answer_pairs):
-            print(f"\n测试答案对 {pair_idx + 1}/{len(answer_pairs)}: {pair['question'][:100]}...")
+        # 复用模式下，试次偏置会抽中的答案对改用单条评判模板（与试次偏置的试验同一提示词和温度），
+        # 结果缓存下来作为其中两次试验；其余答案对照常批量评判
+        single_pairs = set(self._trial_sample(answer_pairs)[0]) if self.reuses_position_verdicts else set()
+        for pair_idx, pair in pending:
+            if pair_idx not in single_pairs:
+                continue
+            print(f"\n单条评判答案对{pair_idx+1}（供试次偏置复用）...")
+            for order, items in (
+                ("hybrid_first", (pair["question"], pair["hybrid_answer"], pair["naive_answer"])),
+                ("naive_first", (pair["question"], pair["naive_answer"], pair["hybrid_answer"]))
+            ):
+                choice = await self.single_judge(
+                    items,
+                    system="你是一个公正的评判者，请客观评价答案质量。",
+                    temperature=JUDGE_TEMPERATURE
+                )
+                raw_choices[(pair_idx, order)] = choice
+                if choice is not None:
+                    self._position_choices[(pair_idx, order)] = choice
+        batched = [(pair_idx, pair) for pair_idx, pair in pending if pair_idx not in single_pairs]
+        
+        # 两种顺序各自单独分批：每个批次只含同一种顺序，
+        # 评判者在一次调用中不会同时看到同一答案对的两种顺序
+        hybrid_first = [
+            (pair_idx, "hybrid_first", (pair["question"], pair["hybrid_answer"], pair["naive_answer"]))
+            for pair_idx, pair in batched
+        ]
+        naive_first = [
+            (pair_idx, "naive_first", (pair["question"], pair["naive_answer"], pair["hybrid_answer"]))
+            for pair_idx, pair in batched
+        ]
+        batches = [
+            judgments[start:start + JUDGE_BATCH_SIZE]
+            for judgments in (hybrid_first, naive_first)
+            for start in range(0, len(judgments), JUDGE_BATCH_SIZE)
+        ]
+        
+        for batch_idx, batch in enumerate(batches):
+            print(f"\n批量评判 {batch_idx + 1}/{len(batches)} ({batch[0][1]}, {len(batch)} 条)...")
             
-            # 测试 Hybrid(A) vs Naive(B)
-            prompt_hybrid_first = judge_prompt_template.format(
-                question=pair["question"],
-                answer_a=pair["hybrid_answer"],
-                answer_b=pair["naive_answer"]
+            single_judged = set()
+            batch_choices = await self.batch_judge(
+                [items for _, _, items in batch],
+                single_judged=single_judged,
+                system="你是一个公正的评判者，请客观评价答案质量。",
+                temperature=JUDGE_TEMPERATURE
             )
+            for item_id, ((pair_idx, order, _), choice) in enumerate(zip(batch, batch_choices)):
+                raw_choices[(pair_idx, order)] = choice
+                if item_id in single_judged and choice is not None:
+                    self._position_choices[(pair_idx, order)] = choice
             
-            # 测试 Naive(A) vs Hybrid(B) - 交换位置
-            prompt_naive_first = judge_prompt_template.format(
-                question=pair["question"],
-                answer_a=pair["naive_answer"],
-                answer_b=pair["hybrid_answer"]
-            )
+            await asyncio.sleep(1)  # 控制请求频率
+        
+        for pair_idx, pair in pending:
+            hybrid_first_choice = raw_choices.get((pair_idx, "hybrid_first"))
+            naive_first_choice = raw_choices.get((pair_idx, "naive_first"))
             
-            try:
-                # 测试Hybrid在A位置
-                result_hybrid_first = await lightrag_llm_func_async(
-                    prompt_hybrid_first,
-                    system="你是一个公正的评判者，请客观评价答案质量。",
-                    max_tokens=300,
-                    temperature=0.1
-                )
-                
-                await asyncio.sleep(1)  # 避免请求过快
-                
-                # 测试Naive在A位置
-                result_naive_first = await lightrag_llm_func_async(
-                    prompt_naive_first,
-                    system="你是一个公正的评判者，请客观评价答案质量。",
-                    max_tokens=300,
-                    temperature=0.1
-                )
-                
-                # 解析结果
-                hybrid_first_choice = self.parse_judge_result(result_hybrid_first)
-                naive_first_choice = self.parse_judge_result(result_naive_first)
-                
-                # 转换为实际选择的模式
-                if hybrid_first_choice == "A":
-                    choice_when_hybrid_first = "hybrid"
-                elif hybrid_first_choice == "B":
-                    choice_when_hybrid_first = "naive"
-                else:
-                    choice_when_hybrid_first = "unclear"
-                
-                if naive_first_choice == "A":
-                    choice_when_naive_first = "naive"
-                elif naive_first_choice == "B":
-                    choice_when_naive_first = "hybrid"
-                else:
-                    choice_when_naive_first = "unclear"
-                
-                # 检查一致性
-                consistent = choice_when_hybrid_first == choice_when_naive_first
-                
-                result_record = {
-                    "pair_id": pair_idx,
-                    "question": pair["question"][:100],
-                    "choice_when_hybrid_first": choice_when_hybrid_first,
-                    "choice_when_naive_first": choice_when_naive_first,
-                    "consistent": consistent,
-                    "length_diff": pair["length_diff"],
-                    "hybrid_length": len(pair["hybrid_answer"]),
-                    "naive_length": len(pair["naive_answer"])
-                }
-                
-                position_bias_results.append(result_record)
-                
-                if not consistent:
-                    print(f"🚨 位置偏置检测: 答案对{pair_idx+1}")
-                    print(f"  Hybrid在前选择: {choice_when_hybrid_first}")
-                    print(f"  Naive在前选择: {choice_when_naive_first}")
-                else:
-                    print(f"✅ 一致选择: {choice_when_hybrid_first}")
-                
-                await asyncio.sleep(1)  # 控制请求频率
-                
-            except Exception as e:
-                print(f"❌ 位置偏置测试失败 (答案对{pair_idx+1}): {e}")
-                await asyncio.sleep(2)
+            if hybrid_first_choice is None or naive_first_choice is None:
+                print(f"❌ 位置偏置测试失败 (答案对{pair_idx+1})")
+                continue
+            
+            # 转换为实际选择的模式
+            if hybrid_first_choice == "A":
+                choice_when_hybrid_first = "hybrid"
+            elif hybrid_first_choice == "B":
+                choice_when_hybrid_first = "naive"
+            else:
+                choice_when_hybrid_first = "unclear"
+            
+            if naive_first_choice == "A":
+                choice_when_naive_first = "naive"
+            elif naive_first_choice == "B":
+                choice_when_naive_first = "hybrid"
+            else:
+                choice_when_naive_first = "unclear"
+            
+            # 检查一致性
+            consistent = choice_when_hybrid_first == choice_when_naive_first
+            
+            result_record = {
+                "pair_id": pair_idx,
+                "question": pair["question"][:100],
+                "choice_when_hybrid_first": choice_when_hybrid_first,
+                "choice_when_naive_first": choice_when_naive_first,
+                "consistent": consistent,
+                "length_diff": pair["length_diff"],
+                "hybrid_length": pair["hybrid_tokens"],
+                "naive_length": pair["naive_tokens"]
+            }
+            
+            position_bias_results.append(result_record)
+            await self._append_partial("position_bias", result_record)
+            
+            if not consistent:
+                print(f"🚨 位置偏置检测: 答案对{pair_idx+1}")
+                print(f"  Hybrid在前选择: {choice_when_hybrid_first}")
+                print(f"  Naive在前选择: {choice_when_naive_first}")
+            else:
+                print(f"✅ 答案对{pair_idx+1} 一致选择: {choice_when_hybrid_first}")
         
         self.results["position_bias"] = position_bias_results
         return position_bias_results
@@ -222,56 +480,40 @@ class JudgeBiasAnalyzer:
     async def test_length_bias_hybrid_naive(self, answer_pairs):
         """测试Hybrid vs Naive的长度偏置"""
         
-        judge_prompt_template = """
-请评判以下两个答案哪个更好地回答了问题：
-
-问题：{question}
-
-答案A：{answer_a}
-
-答案B：{answer_b}
-
-请选择更好的答案（A或B）并简要说明理由：
-"""
+        resumed = self._resumed["length_bias"]
+        length_bias_results = list(resumed.values())
         
-        length_bias_results = []
+        # 选择长度差异较大的答案对（按token计）
+        long_diff_pairs = [(pair_idx, p) for pair_idx, p in enumerate(answer_pairs) if p["length_diff"] >= LENGTH_DIFF_THRESHOLD_TOKENS]
+        print(f"测试 {len(long_diff_pairs)} 个长度差异显著(≥{LENGTH_DIFF_THRESHOLD_TOKENS} tokens)的答案对（{len(resumed)} 个已完成）...")
         
-        # 选择长度差异较大的答案对
-        long_diff_pairs = [p for p in answer_pairs if p["length_diff"] >= 100]
-        print(f"测试 {len(long_diff_pairs)} 个长度差异显著的答案对...")
-        
-        for pair in long_diff_pairs:
+        for pair_idx, pair in long_diff_pairs:
+            if pair_idx in resumed:
+                continue
+            
             # 确定长短答案
-            if len(pair["hybrid_answer"]) > len(pair["naive_answer"]):
-                long_answer = pair["hybrid_answer"]
-                short_answer = pair["naive_answer"]
+            if pair["hybrid_tokens"] > pair["naive_tokens"]:
+                long_answer, long_tokens = pair["hybrid_answer"], pair["hybrid_tokens"]
+                short_answer, short_tokens = pair["naive_answer"], pair["naive_tokens"]
                 long_mode = "hybrid"
                 short_mode = "naive"
             else:
-                long_answer = pair["naive_answer"]
-                short_answer = pair["hybrid_answer"]
+                long_answer, long_tokens = pair["naive_answer"], pair["naive_tokens"]
+                short_answer, short_tokens = pair["hybrid_answer"], pair["hybrid_tokens"]
                 long_mode = "naive"
                 short_mode = "hybrid"
             
-            print(f"\n测试长度偏置: {short_mode}({len(short_answer)}字) vs {long_mode}({len(long_answer)}字)")
+            print(f"\n测试长度偏置: {short_mode}({short_tokens} tokens) vs {long_mode}({long_tokens} tokens)")
             
             # 测试短答案在前
-            prompt_short_first = judge_prompt_template.format(
-                question=pair["question"],
-                answer_a=short_answer,
-                answer_b=long_answer
-            )
+            prompt_short_first = _render(self._length_judge_frags, pair["question"], short_answer, long_answer)
             
             # 测试长答案在前
-            prompt_long_first = judge_prompt_template.format(
-                question=pair["question"],
-                answer_a=long_answer,
-                answer_b=short_answer
-            )
+            prompt_long_first = _render(self._length_judge_frags, pair["question"], long_answer, short_answer)
             
             try:
                 # 短答案在前
-                result_short_first = await lightrag_llm_func_async(
+                result_short_first = await retrying_judge(
                     prompt_short_first,
                     system="你是一个公正的评判者，请客观评价答案质量。",
                     max_tokens=300,
@@ -281,7 +523,7 @@ class JudgeBiasAnalyzer:
                 await asyncio.sleep(1)
                 
                 # 长答案在前
-                result_long_first = await lightrag_llm_func_async(
+                result_long_first = await retrying_judge(
                     prompt_long_first,
                     system="你是一个公正的评判者，请客观评价答案质量。",
                     max_tokens=300,
@@ -295,16 +537,20 @@ class JudgeBiasAnalyzer:
                 chose_longer_when_short_first = choice_short_first == "B"
                 chose_longer_when_long_first = choice_long_first == "A"
                 
-                length_bias_results.append({
+                result_record = {
+                    "pair_id": pair_idx,
                     "question": pair["question"][:100],
                     "short_mode": short_mode,
                     "long_mode": long_mode,
                     "chose_longer_when_short_first": chose_longer_when_short_first,
                     "chose_longer_when_long_first": chose_longer_when_long_first,
-                    "length_ratio": len(long_answer) / len(short_answer),
-                    "short_length": len(short_answer),
-                    "long_length": len(long_answer)
-                })
+                    "length_ratio": long_tokens / short_tokens,
+                    "short_length": short_tokens,
+                    "long_length": long_tokens
+                }
+                
+                length_bias_results.append(result_record)
+                await self._append_partial("length_bias", result_record)
                 
                 print(f"  短在前选择: {'长答案' if chose_longer_when_short_first else '短答案'}")
                 print(f"  长在前选择: {'长答案' if chose_longer_when_long_first else '短答案'}")
@@ -313,7 +559,6 @@ class JudgeBiasAnalyzer:
                 
             except Exception as e:
                 print(f"❌ 长度偏置测试失败: {e}")
-                await asyncio.sleep(2)
         
         self.results["length_bias"] = length_bias_results
         return length_bias_results
@@ -321,68 +566,69 @@ class JudgeBiasAnalyzer:
     async def test_trial_bias_hybrid_naive(self, answer_pairs):
         """测试试次偏置（多次评判同一对答案的一致性）"""
         
-        judge_prompt_template = """
-请评判以下两个答案哪个更好地回答了问题。请从准确性、完整性、清晰度等方面进行评估：
-
-问题：{question}
-
-答案A：{answer_a}
-
-答案B：{answer_b}
-
-请选择更好的答案（A或B）并简要说明理由：
-"""
-        
         trial_bias_results = []
         
-        # 选择部分答案对进行多次试验
-        test_pairs = random.sample(answer_pairs, min(5, len(answer_pairs)))  # 限制测试数量
-        trials_per_pair = 3  # 每对答案测试3次
+        # 选择部分答案对进行多次试验（限制测试数量，每对答案测试TRIALS_PER_PAIR次）
+        sampled_indices, trial_orders = self._trial_sample(answer_pairs)
+        test_pairs = [answer_pairs[i] for i in sampled_indices]
+        trials_per_pair = TRIALS_PER_PAIR
         
         print(f"开始测试试次偏置: {len(test_pairs)} 个答案对，每对测试 {trials_per_pair} 次...")
         
-        for pair_idx, pair in enumerate(test_pairs):
+        reuse_position = self.reuses_position_verdicts
+        resumed = self._resumed["trial_bias"]
+        
+        for pair_idx, (answer_idx, pair) in enumerate(zip(sampled_indices, test_pairs)):
+            # 抽样和答案顺序由固定种子决定，重新运行时pair_id对应同一个答案对
+            if pair_idx in resumed:
+                trial_bias_results.append(resumed[pair_idx])
+                continue
+            
             print(f"\n测试答案对 {pair_idx + 1}/{len(test_pairs)}: {pair['question'][:100]}...")
             
             pair_results = {
                 "pair_id": pair_idx,
                 "question": pair["question"][:100],
-                "hybrid_length": len(pair["hybrid_answer"]),
-                "naive_length": len(pair["naive_answer"]),
+                "hybrid_length": pair["hybrid_tokens"],
+                "naive_length": pair["naive_tokens"],
                 "trials": []
             }
             
+            # 位置偏置测试已在相同温度、相同单条评判模板下评判过的顺序，直接作为前几次试验
+            cached_trials = []
+            if reuse_position:
+                for order in ("hybrid_first", "naive_first"):
+                    choice = self._position_choices.get((answer_idx, order))
+                    if choice is not None:
+                        cached_trials.append((order, choice))
+            cached_trials = cached_trials[:trials_per_pair]
+            
             # 进行多次试验
             for trial_num in range(trials_per_pair):
-                print(f"  试验 {trial_num + 1}/{trials_per_pair}...")
+                from_position_cache = trial_num < len(cached_trials)
+                print(f"  试验 {trial_num + 1}/{trials_per_pair}{' (复用位置偏置结果)' if from_position_cache else ''}...")
                 
-                # 随机选择答案顺序（避免位置偏置影响试次偏置测试）
-                if random.random() < 0.5:
-                    # Hybrid在前
-                    prompt = judge_prompt_template.format(
-                        question=pair["question"],
-                        answer_a=pair["hybrid_answer"],
-                        answer_b=pair["naive_answer"]
-                    )
-                    order = "hybrid_first"
+                if from_position_cache:
+                    order, choice = cached_trials[trial_num]
                 else:
-                    # Naive在前
-                    prompt = judge_prompt_template.format(
-                        question=pair["question"],
-                        answer_a=pair["naive_answer"],
-                        answer_b=pair["hybrid_answer"]
-                    )
-                    order = "naive_first"
+                    order = trial_orders[pair_idx][trial_num]
+                    if order == "hybrid_first":
+                        # Hybrid在前
+                        prompt = _render(self._judge_frags, pair["question"], pair["hybrid_answer"], pair["naive_answer"])
+                    else:
+                        # Naive在前
+                        prompt = _render(self._judge_frags, pair["question"], pair["naive_answer"], pair["hybrid_answer"])
                 
                 try:
-                    result = await lightrag_llm_func_async(
-                        prompt,
-                        system="你是一个公正的评判者，请客观评价答案质量。",
-                        max_tokens=300,
-                        temperature=0.3  # 稍微提高温度以观察变化
-                    )
-                    
-                    choice = self.parse_judge_result(result)
+                    if not from_position_cache:
+                        result = await retrying_judge(
+                            prompt,
+                            system="你是一个公正的评判者，请客观评价答案质量。",
+                            max_tokens=300,
+                            temperature=self.trial_temperature  # 默认稍微提高温度以观察变化
+                        )
+                        
+                        choice = self.parse_judge_result(result)
                     
                     # 将选择转换为实际选择的模式
                     if order == "hybrid_first":
@@ -394,15 +640,16 @@ class JudgeBiasAnalyzer:
                         "trial_num": trial_num + 1,
                         "order": order,
                         "raw_choice": choice,
-                        "actual_choice": actual_choice
+                        "actual_choice": actual_choice,
+                        "from_position_cache": from_position_cache
                     })
                     
                     print(f"    选择: {actual_choice}")
-                    await asyncio.sleep(2)  # 控制请求频率
+                    if not from_position_cache:
+                        await asyncio.sleep(2)  # 控制请求频率
                     
                 except Exception as e:
                     print(f"    ❌ 试验失败: {e}")
-                    await asyncio.sleep(3)
             
             # 分析该答案对的试次一致性
             actual_choices = [t["actual_choice"] for t in pair_results["trials"] if t["actual_choice"] != "unclear"]
@@ -430,6 +677,7 @@ class JudgeBiasAnalyzer:
                     print(f"  ✅ 试次一致性良好: {consistency:.2%}")
             
             trial_bias_results.append(pair_results)
+            await self._append_partial("trial_bias", pair_results)
         
         self.results["trial_bias"] = trial_bias_results
         return trial_bias_results
@@ -437,33 +685,21 @@ class JudgeBiasAnalyzer:
     async def test_hybrid_vs_naive_preference(self, answer_pairs):
         """测试对Hybrid vs Naive的整体偏好"""
         
-        judge_prompt_template = """
-请评判以下两个RAG系统回答哪个更好：
-
-问题：{question}
-
-Hybrid模式回答：{hybrid_answer}
-
-Naive模式回答：{naive_answer}
-
-请选择更好的回答（Hybrid或Naive）并说明理由：
-"""
-        
-        preference_results = []
+        resumed = self._resumed["hybrid_vs_naive_comparison"]
+        preference_results = list(resumed.values())
         
         print(f"测试所有 {len(answer_pairs)} 个答案对的模式偏好...")
         
         for pair_idx, pair in enumerate(answer_pairs[:10]):  # 限制数量避免过多请求
+            if pair_idx in resumed:
+                continue
+            
             print(f"\n测试模式偏好 {pair_idx + 1}/10: {pair['question'][:100]}...")
             
-            prompt = judge_prompt_template.format(
-                question=pair["question"],
-                hybrid_answer=pair["hybrid_answer"],
-                naive_answer=pair["naive_answer"]
-            )
+            prompt = _render(self._preference_frags, pair["question"], pair["hybrid_answer"], pair["naive_answer"])
             
             try:
-                result = await lightrag_llm_func_async(
+                result = await retrying_judge(
                     prompt,
                     system="你是一个公正的评判者，请客观评价RAG系统的回答质量。",
                     max_tokens=300,
@@ -478,41 +714,102 @@ Naive模式回答：{naive_answer}
                 else:
                     choice = "unclear"
                 
-                preference_results.append({
+                result_record = {
                     "pair_id": pair_idx,
                     "question": pair["question"][:100],
                     "choice": choice,
-                    "hybrid_length": len(pair["hybrid_answer"]),
-                    "naive_length": len(pair["naive_answer"]),
+                    "hybrid_length": pair["hybrid_tokens"],
+                    "naive_length": pair["naive_tokens"],
                     "length_diff": pair["length_diff"]
-                })
+                }
+                
+                preference_results.append(result_record)
+                await self._append_partial("hybrid_vs_naive_comparison", result_record)
                 
                 print(f"选择: {choice}")
                 await asyncio.sleep(1)
                 
             except Exception as e:
                 print(f"❌ 模式偏好测试失败: {e}")
-                await asyncio.sleep(2)
         
         self.results["hybrid_vs_naive_comparison"] = preference_results
         return preference_results
     
+    async def batch_judge(self, judge_items, single_judged=None, **kwargs):
+        """将多个(问题, 答案A, 答案B)评判打包到一次LLM调用中
+        
+        返回与judge_items一一对应的选择（A/B/UNCLEAR），批量结果中缺失的条目
+        会退回到单条评判，仍然失败的条目为None。传入single_judged集合时，
+        退回单条评判的条目下标会加入其中
+        """
+        batch_prompt = BATCH_JUDGE_PROMPT_HEADER.format(count=len(judge_items)) + "".join(
+            f"\n### pair_id={item_id}\n" + _render(self._batch_item_frags, *items)
+            for item_id, items in enumerate(judge_items)
+        )
+        
+        batch_choices = {}
+        try:
+            result = await retrying_judge(batch_prompt, max_tokens=300 * len(judge_items), **kwargs)
+            batch_choices = self.parse_batch_judge_result(result)
+        except Exception as e:
+            print(f"❌ 批量评判失败，改为逐条评判: {e}")
+        
+        choices = []
+        for item_id, items in enumerate(judge_items):
+            choice = batch_choices.get(item_id)
+            if choice is None:
+                choice = await self.single_judge(items, **kwargs)
+                if choice is not None and single_judged is not None:
+                    single_judged.add(item_id)
+            choices.append(choice)
+        return choices
+    
+    async def single_judge(self, items, **kwargs):
+        """用单条评判模板评判一个(问题, 答案A, 答案B)，返回A/B/UNCLEAR，失败时返回None"""
+        try:
+            result = await retrying_judge(_render(self._judge_frags, *items), max_tokens=300, **kwargs)
+            return self.parse_judge_result(result)
+        except Exception as e:
+            print(f"❌ 单条评判失败: {e}")
+            return None
+    
+    def parse_batch_judge_result(self, result):
+        """解析批量评判输出的JSON数组，返回 {pair_id: 选择}"""
+        json_start = result.find("[")
+        json_end = result.rfind("]") + 1
+        if json_start == -1 or json_end <= json_start:
+            return {}
+        
+        try:
+            verdicts = json.loads(result[json_start:json_end])
+        except json.JSONDecodeError:
+            return {}
+        
+        choices = {}
+        for verdict in verdicts if isinstance(verdicts, list) else []:
+            if not isinstance(verdict, dict):
+                continue
+            try:
+                item_id = int(verdict.get("pair_id"))
+            except (TypeError, ValueError):
+                continue
+            choice = str(verdict.get("choice", "")).strip().upper()
+            choices[item_id] = choice if choice in ("A", "B") else "UNCLEAR"
+        return choices
+    
     def parse_judge_result(self, result):
         """解析LLM评判结果"""
-        result_lower = result.lower()
-        
-        if "答案a" in result_lower or "选择a" in result_lower or "a更好" in result_lower or "a比较好" in result_lower:
+        if _JUDGE_A_RE.search(result):
             return "A"
-        elif "答案b" in result_lower or "选择b" in result_lower or "b更好" in result_lower or "b比较好" in result_lower:
+        elif _JUDGE_B_RE.search(result):
             return "B"
         else:
-            # 尝试其他解析方式
-            a_count = result.count("A") + result.count("a")
-            b_count = result.count("B") + result.count("b")
+            # 尝试其他解析方式：比较A/B出现次数（str.count在C层扫描，比逐字符Python循环更快）
+            diff = result.count("A") + result.count("a") - result.count("B") - result.count("b")
             
-            if a_count > b_count:
+            if diff > 0:
                 return "A"
-            elif b_count > a_count:
+            elif diff < 0:
                 return "B"
             else:
                 return "UNCLEAR"
@@ -532,17 +829,30 @@ Naive模式回答：{naive_answer}
             print("❌ 没有找到合适的答案对")
             return None
         
-        print("\n1️⃣ 测试位置偏置...")
-        await self.test_position_bias_hybrid_naive(answer_pairs)
+        if self.partial_dir:
+            # 分片只在完整结果保存成功后才删除（见save_results），这里读回上次中断时已完成的结果
+            os.makedirs(self.partial_dir, exist_ok=True)
+            self._resumed = self._load_partial()
+            resumed_count = sum(len(records) for records in self._resumed.values())
+            if resumed_count:
+                print(f"♻️ 从结果分片恢复了 {resumed_count} 条已完成的结果")
         
-        print("\n2️⃣ 测试长度偏置...")
-        await self.test_length_bias_hybrid_naive(answer_pairs)
+        # 四项测试只读answer_pairs、各自写入不同的结果键，可以并发执行；
+        # 总的API并发由 _judge_semaphore 限制
+        print("\n同时测试位置偏置、长度偏置、试次偏置和模式偏好...")
+        position_and_trial = [
+            self.test_position_bias_hybrid_naive(answer_pairs),
+            self.test_trial_bias_hybrid_naive(answer_pairs)
+        ]
+        if self.reuses_position_verdicts:
+            # 试次偏置要复用位置偏置的评判结果，两者需先后执行
+            position_and_trial = [_run_sequentially(*position_and_trial)]
         
-        print("\n3️⃣ 测试试次偏置...")
-        await self.test_trial_bias_hybrid_naive(answer_pairs)
-        
-        print("\n4️⃣ 测试模式偏好...")
-        await self.test_hybrid_vs_naive_preference(answer_pairs)
+        await asyncio.gather(
+            *position_and_trial,
+            self.test_length_bias_hybrid_naive(answer_pairs),
+            self.test_hybrid_vs_naive_preference(answer_pairs)
+        )
         
         return self.results
     
@@ -552,14 +862,24 @@ Naive模式回答：{naive_answer}
         print("🔍 全面偏置分析报告")
         print("="*70)
         
+        # 每类结果只遍历一次，报告和评分共用统计结果
+        position_summary = _summarize_position(self.results.get("position_bias", []))
+        length_summary = _summarize_length(self.results.get("length_bias", []))
+        trial_summary = _summarize_trial(self.results.get("trial_bias", []))
+        preference_summary = _summarize_preference(self.results.get("hybrid_vs_naive_comparison", []))
+        self.summaries = {
+            "position_bias": position_summary,
+            "length_bias": length_summary,
+            "trial_bias": trial_summary,
+            "hybrid_vs_naive_comparison": preference_summary
+        }
+        
         # 位置偏置报告
-        if self.results["position_bias"]:
-            position_data = self.results["position_bias"]
-            consistent_count = sum(1 for item in position_data if item["consistent"])
-            consistency_rate = consistent_count / len(position_data) if position_data else 0
+        if position_summary.total:
+            consistency_rate = position_summary.consistency_rate
             
             print(f"\n📍 位置偏置分析:")
-            print(f"  总测试答案对: {len(position_data)}")
+            print(f"  总测试答案对: {position_summary.total}")
             print(f"  判断一致性: {consistency_rate:.2%}")
             print(f"  偏置程度: {(1-consistency_rate)*100:.1f}%")
             
@@ -569,15 +889,11 @@ Naive模式回答：{naive_answer}
                 print("  ✅  位置偏置在可接受范围内")
         
         # 长度偏置报告
-        if self.results["length_bias"]:
-            length_data = self.results["length_bias"]
-            total_tests = len(length_data) * 2
-            chose_longer_count = sum(1 for item in length_data if item["chose_longer_when_short_first"]) + \
-                               sum(1 for item in length_data if item["chose_longer_when_long_first"])
-            longer_preference = chose_longer_count / total_tests if total_tests > 0 else 0
+        if length_summary.total_pairs:
+            longer_preference = length_summary.longer_preference
             
             print(f"\n📏 长度偏置分析:")
-            print(f"  测试答案对数: {len(length_data)}")
+            print(f"  测试答案对数: {length_summary.total_pairs} (长度按cl100k token计，差异≥{LENGTH_DIFF_THRESHOLD_TOKENS} tokens)")
             print(f"  偏好长答案比例: {longer_preference:.2%}")
             print(f"  长度偏置程度: {abs(longer_preference - 0.5)*200:.1f}%")
             
@@ -587,46 +903,35 @@ Naive模式回答：{naive_answer}
                 print("  ✅  长度偏置在可接受范围内")
         
         # 试次偏置报告
-        if self.results["trial_bias"]:
-            trial_data = self.results["trial_bias"]
-            total_pairs = len(trial_data)
-            biased_pairs = sum(1 for item in trial_data if item.get("has_trial_bias", False))
-            
-            # 计算平均一致性
-            consistency_rates = [item.get("consistency_rate", 0) for item in trial_data if "consistency_rate" in item]
-            avg_consistency = sum(consistency_rates) / len(consistency_rates) if consistency_rates else 0
+        if trial_summary.total_pairs:
+            avg_consistency = trial_summary.avg_consistency or 0
+            biased_ratio = trial_summary.biased_pairs / trial_summary.total_pairs
             
             print(f"\n🔄 试次偏置分析:")
-            print(f"  测试答案对数: {total_pairs}")
+            print(f"  测试答案对数: {trial_summary.total_pairs}")
             print(f"  平均试次一致性: {avg_consistency:.2%}")
-            print(f"  存在试次偏置的答案对: {biased_pairs} ({biased_pairs/total_pairs*100:.1f}%)")
+            print(f"  存在试次偏置的答案对: {trial_summary.biased_pairs} ({biased_ratio*100:.1f}%)")
             
             if avg_consistency < 0.7:
                 print("  ⚠️  检测到严重的试次偏置！")
-            elif biased_pairs / total_pairs > 0.3:
+            elif biased_ratio > 0.3:
                 print("  ⚠️  检测到中等程度的试次偏置")
             else:
                 print("  ✅  试次偏置在可接受范围内")
         
         # 模式偏好报告
-        if self.results["hybrid_vs_naive_comparison"]:
-            preference_data = self.results["hybrid_vs_naive_comparison"]
-            hybrid_count = sum(1 for item in preference_data if item["choice"] == "hybrid")
-            naive_count = sum(1 for item in preference_data if item["choice"] == "naive")
-            
+        if preference_summary.total:
             print(f"\n🔄 模式偏好分析:")
-            print(f"  偏好Hybrid: {hybrid_count} ({hybrid_count/len(preference_data)*100:.1f}%)")
-            print(f"  偏好Naive: {naive_count} ({naive_count/len(preference_data)*100:.1f}%)")
+            print(f"  偏好Hybrid: {preference_summary.hybrid} ({preference_summary.hybrid/preference_summary.total*100:.1f}%)")
+            print(f"  偏好Naive: {preference_summary.naive} ({preference_summary.naive/preference_summary.total*100:.1f}%)")
         
         # 综合偏置评估
         print(f"\n📊 综合偏置评估:")
         bias_score = 0
         
         # 位置偏置评分
-        position_data = self.results.get("position_bias", [])
-        if position_data:
-            consistent_count = sum(1 for item in position_data if item["consistent"])
-            consistency_rate = consistent_count / len(position_data)
+        if position_summary.total:
+            consistency_rate = position_summary.consistency_rate
             
             if consistency_rate < 0.7:
                 bias_score += 30
@@ -638,12 +943,8 @@ Naive模式回答：{naive_answer}
                 print("  - 位置偏置: 轻微 (+0分)")
         
         # 长度偏置评分
-        length_data = self.results.get("length_bias", [])
-        if length_data:
-            total_tests = len(length_data) * 2
-            chose_longer_count = sum(1 for item in length_data if item["chose_longer_when_short_first"]) + \
-                               sum(1 for item in length_data if item["chose_longer_when_long_first"])
-            longer_preference = chose_longer_count / total_tests if total_tests > 0 else 0.5
+        if length_summary.total_pairs:
+            longer_preference = length_summary.longer_preference
             
             if longer_preference > 0.7 or longer_preference < 0.3:
                 bias_score += 25
@@ -655,17 +956,15 @@ Naive模式回答：{naive_answer}
                 print("  - 长度偏置: 轻微 (+0分)")
         
         # 试次偏置评分
-        trial_data = self.results.get("trial_bias", [])
-        if trial_data:
-            consistency_rates = [item.get("consistency_rate", 0) for item in trial_data if "consistency_rate" in item]
-            avg_consistency = sum(consistency_rates) / len(consistency_rates) if consistency_rates else 1.0
-            biased_pairs = sum(1 for item in trial_data if item.get("has_trial_bias", False))
-            total_pairs = len(trial_data)
+        if trial_summary.total_pairs:
+            avg_consistency = trial_summary.avg_consistency
+            if avg_consistency is None:
+                avg_consistency = 1.0
             
             if avg_consistency < 0.7:
                 bias_score += 20
                 print("  - 试次偏置: 严重 (+20分)")
-            elif biased_pairs / total_pairs > 0.3:
+            elif trial_summary.biased_pairs / trial_summary.total_pairs > 0.3:
                 bias_score += 10
                 print("  - 试次偏置: 中等 (+10分)")
             else:
@@ -681,16 +980,58 @@ Naive模式回答：{naive_answer}
         
         # 改进建议
         print(f"\n💡 改进建议:")
-        if any(consistency_rate < 0.8 for consistency_rate in [consistency_rate] if position_data):
+        if position_summary.total and position_summary.consistency_rate < 0.8:
             print("  - 实施双向评判策略减少位置偏置")
-        if any(longer_preference > 0.6 or longer_preference < 0.4 for longer_preference in [longer_preference] if length_data):
+        if length_summary.total_pairs and not 0.4 <= length_summary.longer_preference <= 0.6:
             print("  - 在评判指令中强调质量而非长度")
-        if any(avg_consistency < 0.8 for avg_consistency in [avg_consistency] if trial_data):
+        if trial_summary.total_pairs and avg_consistency < 0.8:
             print("  - 降低temperature参数提高评判一致性")
             print("  - 使用多次评判并取众数结果")
         print("  - 使用盲评方式隐藏模式信息")
         print("  - 考虑使用专门训练的评判模型")
     
+    def _partial_path(self, name):
+        return os.path.join(self.partial_dir, f"{name}.jsonl")
+    
+    def _load_partial(self):
+        """读回结果分片，返回 {测试名: {pair_id: 记录}}；崩溃时写了一半的行会被丢弃"""
+        completed = {}
+        for name in self.results:
+            path = self._partial_path(name)
+            records = {}
+            if os.path.exists(path):
+                truncated = False
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            truncated = True
+                            continue
+                        if "pair_id" in record:
+                            records[record["pair_id"]] = record
+                if truncated:
+                    # 去掉残缺的行后重写分片，之后的追加才不会接在半行后面
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records.values())
+            completed[name] = records
+        return completed
+    
+    def _clear_partial(self):
+        """删除上一次运行留下的结果分片"""
+        if not self.partial_dir:
+            return
+        for name in self.results:
+            if os.path.exists(self._partial_path(name)):
+                os.remove(self._partial_path(name))
+    
+    async def _append_partial(self, name, record):
+        """将单条结果追加到对应的jsonl分片"""
+        if not self.partial_dir:
+            return
+        async with aiofiles.open(self._partial_path(name), 'a', encoding='utf-8') as f:
+            await f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    
     def save_results(self, output_file):
         """保存分析结果"""
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
@@ -698,16 +1039,20 @@ Naive模式回答：{naive_answer}
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(self.results, f, ensure_ascii=False, indent=2)
         
+        # 完整结果已写入，分片不再需要
+        self._clear_partial()
+        
         # 生成详细报告
         self.generate_comprehensive_bias_report()
 
 async def main():
     """主函数"""
-    analyzer = JudgeBiasAnalyzer()
-    
     # 设置数据路径
     results_dir = "../exp_results/data/results"
     questions_file = "../exp_results/data/questions/cs_questions.txt"
+    partial_dir = "../exp_results/data/evaluations/.partial"
+    
+    analyzer = JudgeBiasAnalyzer(partial_dir=partial_dir)
     
     # 运行全面偏置分析（包含三种偏置测试）
     results = await analyzer.run_comprehensive_bias_analysis(results_dir, questions_file)
@@ -722,4 +1067,4 @@ async def main():
         print("❌ 偏置分析失败")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(closing_sessions(main()))
\ No newline at end of file
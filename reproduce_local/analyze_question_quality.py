@@ -2,15 +2,58 @@ import re
 import json
 import os
 from collections import defaultdict
+import numpy as np
+
+from question_io import iter_questions
+
+# 预编译的正则表达式
+_NUM_RE = re.compile(r'\d+\.?\d*')
+_ALG_RE = re.compile(r'[A-Z][a-z]+(?:[A-Z][a-z]+)*(?=\s+algorithm|Algorithm)')
+_PARAM_RE = re.compile(r'(\w+)\s*=\s*(\d+\.?\d*)')
+
+# 宏观问题关键词
+MACRO_KEYWORDS = frozenset([
+    "overall", "general", "main", "primary", "key", "important",
+    "summary", "overview", "compare", "difference", "similarity",
+    "framework", "approach", "methodology", "strategy"
+])
+
+# 细粒度问题关键词
+MICRO_KEYWORDS = frozenset([
+    "specific", "detail", "exactly", "precisely", "particular",
+    "step", "parameter", "value", "implementation", "code",
+    "algorithm", "formula", "equation", "example"
+])
+
+# 问题类型关键词（按判断优先级排列）
+QUESTION_TYPE_KEYWORDS = [
+    ("comparison", frozenset(["compare", "difference", "versus"])),
+    ("summary", frozenset(["summary", "overview", "main"])),
+    ("specific_fact", frozenset(["how", "what", "which", "specific"])),
+    ("integration", frozenset(["integrate", "combine", "relationship"]))
+]
+
+# 所有关键词合并为一个元组，作为命中矩阵的列。
+# `kw in text`走CPython的C级子串搜索，对短问题比正则交替扫描和bytes.find都快
+_ALL_KEYWORDS = tuple(sorted(MACRO_KEYWORDS.union(MICRO_KEYWORDS, *(kws for _, kws in QUESTION_TYPE_KEYWORDS))))
+_MACRO_COLS = np.array([kw in MACRO_KEYWORDS for kw in _ALL_KEYWORDS])
+_MICRO_COLS = np.array([kw in MICRO_KEYWORDS for kw in _ALL_KEYWORDS])
+# (问题类型数, 关键词数)，行顺序即判断优先级
+_TYPE_COLS = np.array([[kw in kws for kw in _ALL_KEYWORDS] for _, kws in QUESTION_TYPE_KEYWORDS])
+
+def _keyword_hits(questions):
+    """构造布尔命中矩阵hits[q, k]：第q个问题是否包含第k个关键词"""
+    hits = np.zeros((len(questions), len(_ALL_KEYWORDS)), dtype=bool)
+    for i, question in enumerate(questions):
+        text = question.lower()
+        hits[i] = [kw in text for kw in _ALL_KEYWORDS]
+    return hits
 
 def analyze_question_granularity(questions_file, contexts_dir):
     """分析问题的粒度和相关性"""
     
     # 读取生成的问题
-    with open(questions_file, 'r', encoding='utf-8') as f:
-        questions_text = f.read()
-    
-    questions = re.findall(r"- Question \d+: (.+)", questions_text)
+    questions = list(iter_questions(questions_file))
     
     # 分析问题特征
     analysis = {
@@ -26,41 +69,21 @@ def analyze_question_granularity(questions_file, contexts_dir):
         }
     }
     
-    # 宏观问题关键词
-    macro_keywords = [
-        "overall", "general", "main", "primary", "key", "important",
-        "summary", "overview", "compare", "difference", "similarity",
-        "framework", "approach", "methodology", "strategy"
-    ]
+    # 所有问题的关键词命中一次算出，后续统计都是矩阵上的归约
+    hits = _keyword_hits(questions)
     
-    # 细粒度问题关键词
-    micro_keywords = [
-        "specific", "detail", "exactly", "precisely", "particular",
-        "step", "parameter", "value", "implementation", "code",
-        "algorithm", "formula", "equation", "example"
-    ]
+    # 统计关键词
+    macro_count = hits[:, _MACRO_COLS].sum(axis=1)
+    micro_count = hits[:, _MICRO_COLS].sum(axis=1)
+    analysis["macro_questions"] = int((macro_count > micro_count).sum())
+    analysis["micro_questions"] = len(questions) - analysis["macro_questions"]
     
-    for question in questions:
-        question_lower = question.lower()
-        
-        # 统计关键词
-        macro_count = sum(1 for kw in macro_keywords if kw in question_lower)
-        micro_count = sum(1 for kw in micro_keywords if kw in question_lower)
-        
-        if macro_count > micro_count:
-            analysis["macro_questions"] += 1
-        else:
-            analysis["micro_questions"] += 1
-            
-        # 问题类型分类
-        if any(word in question_lower for word in ["compare", "difference", "versus"]):
-            analysis["question_types"]["comparison"] += 1
-        elif any(word in question_lower for word in ["summary", "overview", "main"]):
-            analysis["question_types"]["summary"] += 1
-        elif any(word in question_lower for word in ["how", "what", "which", "specific"]):
-            analysis["question_types"]["specific_fact"] += 1
-        elif any(word in question_lower for word in ["integrate", "combine", "relationship"]):
-            analysis["question_types"]["integration"] += 1
+    # 问题类型分类：取第一个命中的类型
+    type_hits = (hits[:, None, :] & _TYPE_COLS[None, :, :]).any(axis=2)
+    first_type = type_hits.argmax(axis=1)[type_hits.any(axis=1)]
+    type_counts = np.bincount(first_type, minlength=len(QUESTION_TYPE_KEYWORDS))
+    for (qtype, _), count in zip(QUESTION_TYPE_KEYWORDS, type_counts):
+        analysis["question_types"][qtype] = int(count)
     
     return analysis, questions
 
@@ -69,28 +92,32 @@ def generate_fine_grained_questions(contexts_dir, output_file):
     
     fine_grained_questions = []
     
-    # 遍历所有context文件
-    for filename in os.listdir(contexts_dir):
-        if filename.endswith('.txt'):
-            filepath = os.path.join(contexts_dir, filename)
+    # 遍历所有context文件（scandir复用目录项中的文件类型信息，无需逐个stat）
+    with os.scandir(contexts_dir) as entries:
+        for entry in entries:
+            if not (entry.is_file() and entry.name.endswith('.txt')):
+                continue
+            filename = entry.name
+            filepath = entry.path
             
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            # 整文件读取：绕过BufferedReader，FileIO按文件大小一次读入后再解码
+            with open(filepath, 'rb', buffering=0) as f:
+                content = f.read().decode('utf-8')
             
-            # 提取具体数字、名称、参数等
-            numbers = re.findall(r'\d+\.?\d*', content)
-            algorithms = re.findall(r'[A-Z][a-z]+(?:[A-Z][a-z]+)*(?=\s+algorithm|Algorithm)', content)
-            parameters = re.findall(r'(\w+)\s*=\s*(\d+\.?\d*)', content)
+            # 提取具体数字、名称、参数等（只用到第一个匹配，search找到即停止扫描）
+            number = _NUM_RE.search(content)
+            algorithm = _ALG_RE.search(content)
+            parameter = _PARAM_RE.search(content)
             
             # 基于具体内容生成问题
-            if numbers:
-                fine_grained_questions.append(f"What is the exact value of {numbers[0]} mentioned in {filename}?")
+            if number:
+                fine_grained_questions.append(f"What is the exact value of {number.group()} mentioned in {filename}?")
             
-            if algorithms:
-                fine_grained_questions.append(f"What are the specific steps of the {algorithms[0]} algorithm described in {filename}?")
+            if algorithm:
+                fine_grained_questions.append(f"What are the specific steps of the {algorithm.group()} algorithm described in {filename}?")
                 
-            if parameters:
-                param_name, param_value = parameters[0]
+            if parameter:
+                param_name, param_value = parameter.groups()
                 fine_grained_questions.append(f"Why is {param_name} set to {param_value} in {filename}?")
     
     # 保存细粒度问题
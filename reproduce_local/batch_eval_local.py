@@ -1,46 +1,42 @@
-import re
 import json
 import jsonlines
 import os
-from local_models import oss_llm_complete
+import asyncio
+from local_models import oss_llm_complete_async, get_oss_ports, closing_sessions
+from json_io import json_dumps
+from question_io import iter_questions
 
-def batch_eval(query_file, result1_file, result2_file, output_file_path):
-    """批量评估两个结果文件"""
-    
-    # 读取查询
-    with open(query_file, "r", encoding="utf-8") as f:
-        data = f.read()
-    queries = re.findall(r"- Question \d+: (.+)", data)
-
-    # 读取结果1
-    with open(result1_file, "r", encoding="utf-8") as f:
-        answers1 = json.load(f)
-    answers1 = [i["result"] for i in answers1]
+_JSON_DECODER = json.JSONDecoder()
 
-    # 读取结果2
-    with open(result2_file, "r", encoding="utf-8") as f:
-        answers2 = json.load(f)
-    answers2 = [i["result"] for i in answers2]
-
-    print(f"查询数量: {len(queries)}")
-    print(f"结果1数量: {len(answers1)}")
-    print(f"结果2数量: {len(answers2)}")
+# 每个OSS端口同时在途的评估请求数，服务端的连续批处理会把它们合并到同一个解码步
+CONCURRENT_PER_PORT = int(os.getenv("CONCURRENT_PER_PORT", "8"))
 
-    if len(queries) != len(answers1) or len(queries) != len(answers2):
-        print("❌ 查询和结果数量不匹配！")
-        return
+# 评估结果JSON的顶层字段
+_EVAL_KEYS = frozenset(["Comprehensiveness", "Diversity", "Empowerment", "Overall Winner"])
 
-    evaluations = []
-    
-    for i, (query, answer1, answer2) in enumerate(zip(queries, answers1, answers2)):
-        print(f"正在评估第 {i+1}/{len(queries)} 个查询...")
-        
-        sys_prompt = """
+def _extract_json(text, idx):
+    """从idx处的'{'开始解析第一个完整的评估JSON对象，找不到时返回None"""
+    while idx != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, idx)
+            # 只接受带评估字段的顶层对象：外层JSON被截断时，
+            # 内层的{"Winner": ..., "Explanation": ...}也能单独解析出来，不能当作有效结果
+            if isinstance(obj, dict) and not _EVAL_KEYS.isdisjoint(obj):
+                return obj
+        except ValueError:
+            pass
+        # 这个'{'不是评估JSON的开头（例如正文中的花括号），继续找下一个
+        idx = text.find('{', idx + 1)
+    return None
+
+async def _one_eval(port, i, query, answer1, answer2):
+    """评估单个查询的两个答案"""
+    sys_prompt = """
         ---Role---
         You are an expert tasked with evaluating two answers to the same question based on three criteria: **Comprehensiveness**, **Diversity**, and **Empowerment**.
         """
 
-        prompt = f"""
+    prompt = f"""
         You will evaluate two answers to the same question based on three criteria: **Comprehensiveness**, **Diversity**, and **Empowerment**.
 
         - **Comprehensiveness**: How much detail does the answer provide to cover all aspects and details of the question?
@@ -84,49 +80,97 @@ def batch_eval(query_file, result1_file, result2_file, output_file_path):
         }}
         """
 
-        try:
-            # 使用OSS API进行评估
-            evaluation_result = oss_llm_complete(
-                prompt=prompt,
-                system_prompt=sys_prompt,
-                max_tokens=2048,
-                temperature=0.1  # 降低温度以获得更一致的评估
-            )
-            
-            # 尝试解析JSON结果
-            try:
-                # 提取JSON部分
-                json_start = evaluation_result.find('{')
-                json_end = evaluation_result.rfind('}') + 1
-                if json_start != -1 and json_end > json_start:
-                    json_str = evaluation_result[json_start:json_end]
-                    evaluation_data = json.loads(json_str)
-                else:
-                    evaluation_data = {"error": "无法找到有效的JSON格式", "raw_response": evaluation_result}
-            except json.JSONDecodeError:
+    try:
+        # 使用OSS API进行评估
+        evaluation_result = await oss_llm_complete_async(
+            prompt=prompt,
+            system_prompt=sys_prompt,
+            max_tokens=2048,
+            temperature=0.1,  # 降低温度以获得更一致的评估
+            port=port
+        )
+        
+        # 尝试解析JSON结果（raw_decode从'{'处直接解析，无需再rfind截取结尾）
+        json_start = evaluation_result.find('{')
+        if json_start == -1:
+            evaluation_data = {"error": "无法找到有效的JSON格式", "raw_response": evaluation_result}
+        else:
+            evaluation_data = _extract_json(evaluation_result, json_start)
+            if evaluation_data is None:
                 evaluation_data = {"error": "JSON解析失败", "raw_response": evaluation_result}
-            
-            evaluation_entry = {
-                "query_index": i,
-                "query": query,
-                "evaluation": evaluation_data
-            }
-            
-            evaluations.append(evaluation_entry)
-            print(f"✅ 第 {i+1} 个查询评估完成")
-            
-        except Exception as e:
-            print(f"❌ 第 {i+1} 个查询评估失败: {e}")
-            evaluation_entry = {
-                "query_index": i,
-                "query": query,
-                "evaluation": {"error": str(e)}
-            }
-            evaluations.append(evaluation_entry)
-
-    # 保存评估结果
-    with open(output_file_path, "w", encoding="utf-8") as output_file:
-        json.dump(evaluations, output_file, ensure_ascii=False, indent=2)
+        
+        evaluation_entry = {
+            "query_index": i,
+            "query": query,
+            "evaluation": evaluation_data
+        }
+        
+        print(f"✅ 第 {i+1} 个查询评估完成")
+        return evaluation_entry
+        
+    except Exception as e:
+        print(f"❌ 第 {i+1} 个查询评估失败: {e}")
+        evaluation_entry = {
+            "query_index": i,
+            "query": query,
+            "evaluation": {"error": str(e)}
+        }
+        return evaluation_entry
+
+async def batch_eval(query_file, result1_file, result2_file, output_file_path):
+    """批量评估两个结果文件"""
+    
+    # 读取查询
+    queries = list(iter_questions(query_file))
+
+    # 读取结果1
+    with open(result1_file, "r", encoding="utf-8") as f:
+        answers1 = json.load(f)
+    answers1 = [i["result"] for i in answers1]
+
+    # 读取结果2
+    with open(result2_file, "r", encoding="utf-8") as f:
+        answers2 = json.load(f)
+    answers2 = [i["result"] for i in answers2]
+
+    print(f"查询数量: {len(queries)}")
+    print(f"结果1数量: {len(answers1)}")
+    print(f"结果2数量: {len(answers2)}")
+
+    if len(queries) != len(answers1) or len(queries) != len(answers2):
+        print("❌ 查询和结果数量不匹配！")
+        return
+
+    # 每个OSS端口启动CONCURRENT_PER_PORT个消费者，从共享队列取任务，
+    # 较快的端口自然会多处理一些
+    ports = get_oss_ports()
+    print(f"最大并发评估数: {len(ports) * CONCURRENT_PER_PORT} ({len(ports)} 个端口 x {CONCURRENT_PER_PORT})")
+    
+    pending = asyncio.Queue()
+    for item in enumerate(zip(queries, answers1, answers2)):
+        pending.put_nowait(item)
+    
+    # 按查询下标写回，保证结果顺序与查询顺序一致
+    evaluations = [None] * len(queries)
+    
+    async def consumer(port):
+        while True:
+            try:
+                i, (query, answer1, answer2) = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            evaluations[i] = await _one_eval(port, i, query, answer1, answer2)
+    
+    await asyncio.gather(*[
+        consumer(port)
+        for port in ports
+        for _ in range(CONCURRENT_PER_PORT)
+    ])
+
+    # 保存评估结果：先整体序列化再一次性写入，避免json.dump逐个片段调用write（安装了orjson时走orjson）
+    payload = json_dumps(evaluations, indent=True)
+    with open(output_file_path, "wb", buffering=1 << 20) as output_file:
+        output_file.write(payload)
     
     print(f"✅ 评估完成，结果保存到: {output_file_path}")
     
@@ -204,7 +248,7 @@ def main():
     print(f"结果2文件: {result2_file}")
     print(f"输出文件: {output_file}")
     
-    batch_eval(query_file, result1_file, result2_file, output_file)
+    asyncio.run(closing_sessions(batch_eval(query_file, result1_file, result2_file, output_file)))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Qwen Embedding编码的公共部分
+local_models（本地编码）和 embedding_server（HTTP服务）共用，保证两边得到的向量一致；
+只有常量和纯函数，导入时没有副作用（导出脚本等工具也可直接使用）
+"""
+
+import hashlib
+import torch
+from typing import List
+
+# 本地Qwen3-Embedding模型路径
+QWEN_MODEL_PATH = "/mnt/jfs/xubenfeng/rag/models_and_datasets/Qwen3-Embedding-0.6B"
+
+# 按token长度分桶，每个子批次只pad到其中最长的序列
+LENGTH_BUCKETS = (64, 128, 256, 512)
+MAX_LENGTH = 512
+
+def select_dtype(device: str) -> torch.dtype:
+    """GPU上使用半精度推理（支持时优先BF16，否则FP16），CPU保持FP32"""
+    if not str(device).startswith("cuda"):
+        return torch.float32
+    return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+def masked_mean_pool(last_hidden_state: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """按attention mask做mean pooling，padding位置不参与平均。
+    
+    权重(mask/有效长度)先乘进去再用bmm求和：不用把[B, L, H]整体升到FP32，
+    矩阵乘内部按FP32累加，结果是均值量级，FP16下也不会溢出；返回FP32"""
+    mask = attention_mask.float()
+    weights = (mask / mask.sum(dim=1, keepdim=True).clamp(min=1)).to(last_hidden_state.dtype)
+    return torch.bmm(weights.unsqueeze(1), last_hidden_state).squeeze(1).float()
+
+def text_key(text: str) -> bytes:
+    """文本内容的哈希，作为embedding缓存的键"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def unique_misses(keys: List[bytes], embeddings: list) -> List[int]:
+    """未命中缓存的下标；同一文本在批内重复出现时只保留第一次，只编码一遍"""
+    seen = set()
+    miss_idx = []
+    for i, vector in enumerate(embeddings):
+        if vector is None and keys[i] not in seen:
+            seen.add(keys[i])
+            miss_idx.append(i)
+    return miss_idx
+
+def batch_size_steps(max_batch_size: int) -> tuple:
+    """编译模式下的批大小档位：小于max_batch_size的2的幂，再加上max_batch_size本身"""
+    steps = []
+    size = 1
+    while size < max_batch_size:
+        steps.append(size)
+        size *= 2
+    steps.append(max_batch_size)
+    return tuple(steps)
+
+def pad_rows(inputs: dict, batch_sizes: tuple, pad_token_id: int) -> dict:
+    """把批大小pad到最近的档位；补齐行的输出不会被使用，mask取1避免整行被屏蔽"""
+    rows, seq_len = inputs["input_ids"].shape
+    target = next(size for size in batch_sizes if size >= rows)
+    if target == rows:
+        return inputs
+    extra = target - rows
+    return {
+        "input_ids": torch.cat([inputs["input_ids"], inputs["input_ids"].new_full((extra, seq_len), pad_token_id)]),
+        "attention_mask": torch.cat([inputs["attention_mask"], inputs["attention_mask"].new_ones((extra, seq_len))])
+    }
+
+def ensure_recompile_limit(num_shapes: int) -> None:
+    """把dynamo的重编译上限提高到至少num_shapes。
+    
+    dynamic=False时每种输入形状各编译一份，超过上限(默认8)后dynamo会静默退回eager执行；
+    新版本叫recompile_limit，旧版本叫cache_size_limit"""
+    config = torch._dynamo.config
+    for name in ("recompile_limit", "cache_size_limit"):
+        if hasattr(config, name):
+            current = getattr(config, name)
+            if current < num_shapes:
+                print(f"⚠️ 编译形状数 {num_shapes} 超过dynamo重编译上限 {current}，已提高到 {num_shapes}")
+                setattr(config, name, num_shapes)
+            break
+    # 所有函数累计的重编译次数也有上限
+    for name in ("accumulated_recompile_limit", "accumulated_cache_size_limit"):
+        if hasattr(config, name):
+            setattr(config, name, max(getattr(config, name), num_shapes))
+            break
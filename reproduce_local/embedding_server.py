@@ -9,62 +9,303 @@ import sys
 import argparse
 import json
 import time
-from flask import Flask, request, jsonify
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+import uvicorn
 import torch
 import numpy as np
 from transformers import AutoTokenizer, AutoModel
 from typing import List
 
+from embedding_common import LENGTH_BUCKETS, MAX_LENGTH, select_dtype, masked_mean_pool, text_key, unique_misses, ensure_recompile_limit, batch_size_steps, pad_rows
+
+# orjson可选：安装后直接序列化numpy向量，省去tolist()和标准库逐个浮点数编码
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class _EmbeddingRequest:
+    """一次编码请求，由批处理线程填充结果；异步调用方通过future等待"""
+    __slots__ = ("texts", "result", "error", "done", "loop", "future")
+    
+    def __init__(self, texts: List[str], loop: asyncio.AbstractEventLoop = None):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+    
+    def finish(self):
+        """在批处理线程中调用：唤醒同步等待者，并把结果转交给事件循环"""
+        self.done.set()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._resolve_future)
+    
+    def _resolve_future(self):
+        if self.future.cancelled():
+            return
+        if self.error is not None:
+            self.future.set_exception(self.error)
+        else:
+            self.future.set_result(self.result)
+
 class QwenEmbeddingServer:
-    def __init__(self, model_path: str, device: str = None):
+    def __init__(self, model_path: str, device: str = None, max_batch_size: int = 64, batch_wait_ms: float = 5,
+                 cache_size: int = 100000, compile_model: bool = False):
         self.model_path = model_path
         self.device = device if device else ("cuda" if torch.cuda.is_available() else "cpu")
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        
+        # 按文本内容哈希缓存embedding（LRU），重复文本不再进入模型；cache_size为0时关闭
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.RLock()
         
         print(f"🤖 加载Qwen Embedding模型: {model_path}")
-        print(f"📱 设备: {self.device}")
+        self.dtype = select_dtype(self.device)
+        print(f"📱 设备: {self.device}, 精度: {self.dtype}")
         
         # 加载模型
         self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-        self.model = AutoModel.from_pretrained(model_path, trust_remote_code=True)
-        self.model.eval()
-        self.model = self.model.to(self.device)
+        self.model = AutoModel.from_pretrained(model_path, torch_dtype=self.dtype, trust_remote_code=True)
+        self.model = self.model.to(self.device).eval()
+        
+        # 可选：torch.compile(reduce-overhead)用CUDA Graph重放前向，省去逐kernel的Python调度开销。
+        # CUDA Graph按输入形状分别记录：编译后序列维pad到桶的上限长度，批大小pad到2的幂档位（上限为max_batch_size），
+        # 形状只有 len(LENGTH_BUCKETS) x len(batch_sizes) 种，全部在预热时记录，服务期间不再重新编译
+        self.compiled = compile_model and self.device.startswith("cuda") and hasattr(torch, "compile")
+        self.batch_sizes = batch_size_steps(max_batch_size)
+        self._forward = self.model
+        if self.compiled:
+            print("⚙️ 编译模型前向 (torch.compile, mode=reduce-overhead)...")
+            ensure_recompile_limit(len(LENGTH_BUCKETS) * len(self.batch_sizes))
+            self._forward = torch.compile(self.model, mode="reduce-overhead", fullgraph=False, dynamic=False)
         
         print(f"✅ 模型加载完成!")
         
+        # GPU上用独立的拷贝stream和锁页内存做异步D2H，使拷贝与下一个桶的前向计算重叠
+        self._copy_stream = torch.cuda.Stream(device=self.device) if self.device.startswith("cuda") else None
+        self._host_buf = None
+        
+        # 并发请求先进入队列，由单个工作线程合并成批次送入GPU
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True)
+        self._worker.start()
+        
     def encode_texts(self, texts: List[str]) -> np.ndarray:
-        """编码文本为向量"""
-        try:
-            # Tokenize
-            inputs = self.tokenizer(
-                texts,
-                padding=True,
-                truncation=True,
-                return_tensors="pt",
-                max_length=512
-            )
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        """编码文本为向量（先查缓存，未命中的文本与其他并发请求合并批处理）"""
+        if not texts:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        
+        keys = [text_key(text) for text in texts]
+        embeddings = self._cache_lookup(keys)
+        miss_idx = unique_misses(keys, embeddings)
+        if not miss_idx:
+            return np.stack(embeddings)
+        
+        request = _EmbeddingRequest([texts[i] for i in miss_idx])
+        self._requests.put(request)
+        request.done.wait()
+        
+        if request.error is not None:
+            raise request.error
+        return self._merge_computed(keys, embeddings, miss_idx, request.result)
+    
+    async def encode_texts_async(self, texts: List[str]) -> np.ndarray:
+        """encode_texts的异步版本：在事件循环中等待批处理结果，不占用线程"""
+        if not texts:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        
+        keys = [text_key(text) for text in texts]
+        embeddings = self._cache_lookup(keys)
+        miss_idx = unique_misses(keys, embeddings)
+        if not miss_idx:
+            return np.stack(embeddings)
+        
+        request = _EmbeddingRequest([texts[i] for i in miss_idx], asyncio.get_running_loop())
+        self._requests.put(request)
+        result = await request.future
+        return self._merge_computed(keys, embeddings, miss_idx, result)
+    
+    def _merge_computed(self, keys: List[bytes], embeddings: list, miss_idx: List[int], computed: np.ndarray) -> np.ndarray:
+        """写入新算出的向量到缓存，并按原顺序拼回完整结果"""
+        self._cache_store([keys[i] for i in miss_idx], computed)
+        # 按键回填，批内重复的文本共用同一个结果
+        computed_by_key = {keys[i]: computed[j] for j, i in enumerate(miss_idx)}
+        for i, vector in enumerate(embeddings):
+            if vector is None:
+                embeddings[i] = computed_by_key[keys[i]]
+        return np.stack(embeddings)
+    
+    def _cache_lookup(self, keys: List[bytes]) -> list:
+        """批量查询缓存，未命中的位置为None"""
+        with self._cache_lock:
+            cached = []
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                cached.append(vector)
+            return cached
+    
+    def _cache_store(self, keys: List[bytes], vectors: np.ndarray):
+        """写入缓存并淘汰超出上限的旧条目"""
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            for key, vector in zip(keys, vectors):
+                # 复制一行，避免缓存持有整个批次数组的引用
+                self._cache[key] = vector.copy()
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _batch_loop(self):
+        """收集一个时间窗口内的请求，合并后统一编码，再按请求拆分结果"""
+        # CUDA Graph按线程记录，预热必须在实际执行前向的批处理线程中进行
+        if self.compiled:
+            self._warmup()
+        
+        while True:
+            pending = [self._requests.get()]
+            total = len(pending[0].texts)
+            deadline = time.monotonic() + self.batch_wait
             
-            # 生成embeddings
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                embeddings = outputs.last_hidden_state.mean(dim=1)
-                embeddings = embeddings.cpu().numpy()
+            while total < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                total += len(request.texts)
             
-            return embeddings
+            try:
+                embeddings = self._encode_batch([text for request in pending for text in request.texts])
+            except Exception as e:
+                print(f"❌ Embedding生成失败: {e}")
+                for request in pending:
+                    request.error = e
+                    request.finish()
+                continue
             
-        except Exception as e:
-            print(f"❌ Embedding生成失败: {e}")
-            raise e
+            offset = 0
+            for request in pending:
+                request.result = embeddings[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.finish()
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """按token长度排序分桶后编码，减少padding带来的无效计算"""
+        encoded = self.tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+        input_ids = encoded["input_ids"]
+        attention_mask = encoded["attention_mask"]
+        
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+        # host的第k行对应order[k]，即按长度排序后的顺序
+        if self._copy_stream is not None:
+            host = self._pinned_buffer(len(texts))
+        else:
+            host = torch.empty((len(texts), self.model.config.hidden_size), dtype=torch.float32)
+        
+        start = 0
+        while start < len(order):
+            # 当前桶：长度上限相同且不超过max_batch_size的一段连续序列
+            bucket = next(b for b in LENGTH_BUCKETS if len(input_ids[order[start]]) <= b)
+            end = start
+            while (end < len(order) and end - start < self.max_batch_size
+                   and len(input_ids[order[end]]) <= bucket):
+                end += 1
+            indices = order[start:end]
+            
+            inputs = self.tokenizer.pad(
+                {
+                    "input_ids": [input_ids[i] for i in indices],
+                    "attention_mask": [attention_mask[i] for i in indices]
+                },
+                padding="max_length" if self.compiled else "longest",
+                max_length=bucket,
+                return_tensors="pt"
+            )
+            if self.compiled:
+                inputs = pad_rows(inputs, self.batch_sizes, self.tokenizer.pad_token_id or 0)
+            if self._copy_stream is not None:
+                # 锁页内存 + non_blocking：H2D拷贝异步提交，不阻塞后续kernel的下发
+                inputs = {k: v.pin_memory().to(self.device, non_blocking=True) for k, v in inputs.items()}
+            else:
+                inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            
+            with torch.inference_mode():
+                outputs = self._forward(**inputs)
+                pooled = masked_mean_pool(outputs.last_hidden_state, inputs["attention_mask"])
+                # L2归一化，调用方无需再自行归一化
+                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            # 只拷回真实文本的行，批大小档位补齐的行丢弃
+            self._copy_to_host(pooled[:end - start], host[start:end])
+            
+            start = end
+        
+        if self._copy_stream is not None:
+            self._copy_stream.synchronize()
+        
+        embeddings = np.empty((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        embeddings[order] = host[:len(texts)].numpy()
+        return embeddings
+    
+    def _warmup(self):
+        """对每个(长度桶, 批大小档位)形状跑前向，提前触发编译和CUDA Graph记录"""
+        print(f"🔥 预热编译形状: {len(LENGTH_BUCKETS)} 个长度桶 x {len(self.batch_sizes)} 个批大小档位")
+        for bucket in LENGTH_BUCKETS:
+            for batch in self.batch_sizes:
+                input_ids = torch.full((batch, bucket), self.tokenizer.pad_token_id or 0, dtype=torch.long, device=self.device)
+                attention_mask = torch.ones_like(input_ids)
+                # reduce-overhead模式下同一形状第一次调用只做预热，之后的调用才记录CUDA Graph
+                for _ in range(2):
+                    with torch.inference_mode():
+                        self._forward(input_ids=input_ids, attention_mask=attention_mask)
+        torch.cuda.synchronize(self.device)
+    
+    def _pinned_buffer(self, rows: int) -> torch.Tensor:
+        """按需扩容的锁页内存缓冲区（只在批处理线程中使用）"""
+        if self._host_buf is None or self._host_buf.shape[0] < rows:
+            self._host_buf = torch.empty(
+                (max(rows, self.max_batch_size), self.model.config.hidden_size),
+                dtype=torch.float32,
+                pin_memory=True
+            )
+        return self._host_buf
+    
+    def _copy_to_host(self, pooled: torch.Tensor, dst: torch.Tensor):
+        """将池化结果拷回host；GPU上在拷贝stream中异步执行"""
+        if self._copy_stream is None:
+            dst.copy_(pooled)
+            return
+        
+        self._copy_stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self._copy_stream):
+            dst.copy_(pooled, non_blocking=True)
+        # pooled在拷贝完成前不能被计算stream的分配器复用
+        pooled.record_stream(self._copy_stream)
 
 def create_app(embedding_server: QwenEmbeddingServer):
-    """创建Flask应用"""
-    app = Flask(__name__)
+    """创建FastAPI应用"""
+    app = FastAPI()
     
-    @app.route('/v1/embeddings', methods=['POST'])
-    def get_embeddings():
+    @app.post('/v1/embeddings')
+    async def get_embeddings(request: Request):
         """OpenAI兼容的embeddings接口"""
         try:
-            data = request.get_json()
+            body = await request.body()
+            data = orjson.loads(body) if orjson is not None else json.loads(body)
             
             # 解析输入
             input_texts = data.get('input', [])
@@ -75,7 +316,7 @@ def create_app(embedding_server: QwenEmbeddingServer):
             
             # 生成embeddings
             start_time = time.time()
-            embeddings = embedding_server.encode_texts(input_texts)
+            embeddings = await embedding_server.encode_texts_async(input_texts)
             end_time = time.time()
             
             # 构造响应
@@ -93,33 +334,37 @@ def create_app(embedding_server: QwenEmbeddingServer):
                 response["data"].append({
                     "object": "embedding",
                     "index": i,
-                    "embedding": embedding.tolist()
+                    "embedding": embedding if orjson is not None else embedding.tolist()
                 })
             
             print(f"✅ 处理 {len(input_texts)} 个文本, 用时: {end_time-start_time:.3f}s")
-            return jsonify(response)
+            # 直接返回响应，跳过jsonable_encoder对每个浮点数的逐个遍历
+            if orjson is not None:
+                return Response(orjson.dumps(response, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+            return JSONResponse(response)
             
         except Exception as e:
             print(f"❌ 请求处理失败: {e}")
-            return jsonify({"error": str(e)}), 500
+            return JSONResponse({"error": str(e)}, status_code=500)
     
-    @app.route('/v1/models', methods=['GET'])
-    def list_models():
+    @app.get('/v1/models')
+    async def list_models():
         """列出可用模型"""
-        return jsonify({
+        return {
             "object": "list",
             "data": [{
                 "id": "qwen-embedding",
                 "object": "model",
                 "created": int(time.time()),
-                "owned_by": "local"
+                "owned_by": "local",
+                "dimensions": embedding_server.model.config.hidden_size
             }]
-        })
+        }
     
-    @app.route('/health', methods=['GET'])
-    def health_check():
+    @app.get('/health')
+    async def health_check():
         """健康检查"""
-        return jsonify({"status": "healthy"})
+        return {"status": "healthy"}
     
     return app
 
@@ -129,16 +374,24 @@ def main():
     parser.add_argument("--host", default="0.0.0.0", help="服务地址")
     parser.add_argument("--port", type=int, required=True, help="端口号")
     parser.add_argument("--device", default=None, help="设备 (cuda/cpu)")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="单次前向的最大文本数")
+    parser.add_argument("--batch-wait-ms", type=float, default=5, help="合并并发请求的等待窗口（毫秒）")
+    parser.add_argument("--compile", action="store_true", help="使用torch.compile编译模型前向（仅GPU）")
+    parser.add_argument("--cache-size", type=int, default=100000, help="embedding缓存的最大条目数（0表示关闭）")
     
     args = parser.parse_args()
     
     # 创建Embedding服务器
     embedding_server = QwenEmbeddingServer(
         model_path=args.model_path,
-        device=args.device
+        device=args.device,
+        max_batch_size=args.max_batch_size,
+        batch_wait_ms=args.batch_wait_ms,
+        cache_size=args.cache_size,
+        compile_model=args.compile
     )
     
-    # 创建Flask应用
+    # 创建FastAPI应用
     app = create_app(embedding_server)
     
     print(f"🚀 启动Qwen Embedding服务:")
@@ -146,8 +399,8 @@ def main():
     print(f"  模型: {args.model_path}")
     print(f"  设备: {embedding_server.device}")
     
-    # 启动服务
-    app.run(host=args.host, port=args.port, threaded=True)
+    # 启动服务：单进程（模型只加载一次），已安装uvloop/httptools时uvicorn会自动使用
+    uvicorn.run(app, host=args.host, port=args.port, workers=1, loop="auto", http="auto", access_log=False)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+导出Qwen3-Embedding为ONNX模型
+导出后设置 ORT_EMBED_PATH=<输出路径>，local_models 会改用 ONNX Runtime 推理
+加 --int8 时额外生成动态量化（INT8权重）的模型 <输出路径>.int8.onnx
+"""
+
+import argparse
+import os
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+# 只从无副作用的公共模块取模型路径，不导入local_models（其导入时会创建线程池、打开磁盘缓存等）
+from embedding_common import QWEN_MODEL_PATH
+
+class _LastHiddenState(torch.nn.Module):
+    """只输出last_hidden_state，pooling留给推理端做"""
+    
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+def main():
+    parser = argparse.ArgumentParser(description="导出Qwen3-Embedding为ONNX模型")
+    parser.add_argument("--model-path", default=QWEN_MODEL_PATH, help="模型路径")
+    parser.add_argument("--output", default="qwen_embed.onnx", help="输出的ONNX文件")
+    parser.add_argument("--fp16", action="store_true", help="以FP16导出（需要GPU）")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset版本")
+    parser.add_argument("--int8", action="store_true", help="额外导出INT8动态量化模型（需要FP32导出）")
+    
+    args = parser.parse_args()
+    if args.int8 and args.fp16:
+        parser.error("--int8 需要在FP32模型上量化，不能与 --fp16 同时使用")
+    
+    device = "cuda" if args.fp16 else "cpu"
+    dtype = torch.float16 if args.fp16 else torch.float32
+    
+    print(f"🤖 加载模型: {args.model_path}")
+    tokenizer = AutoTokenizer.from_pretrained(args.model_path, trust_remote_code=True)
+    model = AutoModel.from_pretrained(args.model_path, torch_dtype=dtype, trust_remote_code=True)
+    model = _LastHiddenState(model.to(device).eval())
+    
+    # 用一个示例批次确定计算图，batch和序列长度两个维度都是动态的
+    sample = tokenizer(["这是一个测试", "another test sentence"], padding=True, return_tensors="pt")
+    input_ids = sample["input_ids"].to(device)
+    attention_mask = sample["attention_mask"].to(device)
+    
+    print(f"📦 导出ONNX: {args.output} (opset {args.opset}, 精度 {dtype})")
+    # 导出需要走tracing，不能用inference_mode产生的推理张量
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (input_ids, attention_mask),
+            args.output,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "last_hidden_state": {0: "batch", 1: "seq"}
+            },
+            opset_version=args.opset
+        )
+    
+    output = args.output
+    if args.int8:
+        # 线性层权重量化为INT8，激活在运行时动态量化；CPU上走VNNI的整数矩阵乘
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        output = os.path.splitext(args.output)[0] + ".int8.onnx"
+        print(f"🔢 INT8动态量化: {output}")
+        quantize_dynamic(args.output, output, weight_type=QuantType.QInt8)
+    
+    print(f"✅ 导出完成! 使用方式: export ORT_EMBED_PATH={output}")
+    print(f"  如需TensorRT: trtexec --onnx={args.output} --fp16 "
+          f"--minShapes=input_ids:1x1,attention_mask:1x1 "
+          f"--optShapes=input_ids:32x128,attention_mask:32x128 "
+          f"--maxShapes=input_ids:64x512,attention_mask:64x512")
+
+if __name__ == "__main__":
+    main()
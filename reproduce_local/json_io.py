@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+JSON编解码
+orjson可选：安装后走更快的实现，否则回退到标准库；local_models（请求体、响应）和 batch_eval_local（结果文件）共用
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """序列化为UTF-8字节（请求体、结果文件）；indent=True时按2空格缩进"""
+    if orjson is not None:
+        # 允许非str键（如logit_bias的{token_id: bias}），与标准库json一致
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+def json_loads(data: bytes) -> Any:
+    """解析响应体"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
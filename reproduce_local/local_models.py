@@ -5,11 +5,12 @@ OSS API + Qwen3-Embedding-0.6B
 """
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import torch
 import numpy as np
 import os
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoTokenizer, AutoModel, AutoConfig
 from typing import List, Any, Dict
 import asyncio
 import aiohttp
@@ -18,36 +19,182 @@ from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_excep
 # ==================== OSS LLM 配置 ====================
 import threading
 import random
+import itertools
+import atexit
+import contextlib
+import functools
+import queue
+import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from json_io import json_dumps, json_loads
+from embedding_common import QWEN_MODEL_PATH, LENGTH_BUCKETS, MAX_LENGTH, select_dtype, masked_mean_pool, text_key, unique_misses, ensure_recompile_limit, batch_size_steps, pad_rows
 
 # OSS LLM负载均衡配置
-_oss_counter = 0
-_oss_lock = threading.Lock()
+# (环境变量取值, 端口轮询迭代器, 端口->配置)；环境变量变化时重建
+_oss_rotation = None
 
 # ==================== Embedding服务配置 ====================
 # Embedding服务负载均衡配置
-_embedding_counter = 0
-_embedding_lock = threading.Lock()
+_embedding_rotation = None
 _use_remote_embedding = False  # 是否使用远程Embedding服务
 
-def get_oss_config():
-    """获取OSS配置，支持多端口负载均衡"""
-    global _oss_counter
+# ==================== HTTP连接复用 ====================
+# 同步调用：每个线程复用requests.Session（连接池 + keep-alive）。
+# 生成请求与Embedding/模型信息请求分用两个会话：只有后者是幂等的，可以按状态码重试
+_session_tls = threading.local()
+
+def _new_session(max_retries: Retry) -> requests.Session:
+    """创建挂载了连接池和重试策略的requests.Session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=max_retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _session() -> requests.Session:
+    """获取当前线程复用的LLM生成会话：只重试请求发出前的连接失败，
+    网关错误(如504)时后端可能已经生成完毕，重发会重复生成"""
+    session = getattr(_session_tls, "session", None)
+    if session is None:
+        session = _new_session(Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5))
+        _session_tls.session = session
+    return session
+
+def _retrying_session() -> requests.Session:
+    """获取当前线程复用的幂等请求会话（Embedding、模型信息）：
+    服务过载/重启时的网关错误和连接失败自动重试"""
+    session = getattr(_session_tls, "retrying_session", None)
+    if session is None:
+        session = _new_session(Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False
+        ))
+        _session_tls.retrying_session = session
+    return session
+
+# thinking模式输出中最终答案前的标记
+_MARKER = "assistantfinal"
+_MARKER_LEN = len(_MARKER)
+
+def _strip_thinking(content: str) -> str:
+    """去掉thinking模式输出中"analysis...assistantfinal"的推理部分，只保留最终答案"""
+    marker_idx = content.rfind(_MARKER)
+    if marker_idx != -1 and content.find("analysis", 0, marker_idx) != -1:
+        return content[marker_idx + _MARKER_LEN:].strip()
+    return content
+
+# OSS_STREAM=1时异步OSS调用走流式响应（请求时显式传stream=...可覆盖）。
+# 调用方仍要等完整结果，流式只省去整块响应体的缓冲和解析，默认关闭
+_OSS_STREAM = os.getenv("OSS_STREAM", "0") == "1"
+
+async def _read_stream_content(response: aiohttp.ClientResponse) -> str:
+    """
+    逐条读取流式(SSE)响应的delta.content，边收边丢弃thinking模式的推理部分。
+    标记在解码后的文本上查找（标记可能被拆在两个delta里），结果与_strip_thinking(完整输出)一致。
+    服务端返回错误事件、或流在[DONE]/finish_reason之前结束时抛出RuntimeError，不返回残缺的文本
+    """
+    text = ""
+    stripped = False  # 是否已经丢弃过"analysis...assistantfinal"前缀
+    finished = False
+    async for line in response.content:
+        if not line.startswith(b"data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            finished = True
+            break
+        chunk = json_loads(payload)
+        if chunk.get("error"):
+            raise RuntimeError(f"流式响应返回错误: {chunk['error']}")
+        choices = chunk.get("choices")
+        if not choices:
+            continue
+        if choices[0].get("finish_reason"):
+            finished = True
+        delta = (choices[0].get("delta") or {}).get("content")
+        if not delta:
+            continue
+        
+        # 只在新到达的部分（加上可能跨界的标记前缀）里找标记
+        start = max(0, len(text) - _MARKER_LEN + 1)
+        text += delta
+        marker_idx = text.find(_MARKER, start)
+        while marker_idx != -1:
+            if stripped or text.find("analysis", 0, marker_idx) != -1:
+                text = text[marker_idx + _MARKER_LEN:]
+                stripped = True
+                marker_idx = text.find(_MARKER)
+            else:
+                marker_idx = text.find(_MARKER, marker_idx + 1)
     
-    # 从环境变量读取配置
-    oss_host = os.getenv("OSS_HOST", "10.0.4.178")
+    if not finished:
+        raise RuntimeError("流式响应在生成结束前中断")
+    return text.strip() if stripped else text
+
+# 异步调用：每个事件循环复用一个aiohttp.ClientSession，OSS和远程Embedding共用
+_async_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+def _get_async_session() -> aiohttp.ClientSession:
+    """获取当前事件循环复用的aiohttp会话（会话与创建它的事件循环绑定）"""
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        # 顺带清理已关闭事件循环留下的会话
+        for stale in [old_loop for old_loop in _async_sessions if old_loop.is_closed()]:
+            del _async_sessions[stale]
+        # 按端口限制连接数（aiohttp按host:port计），批量评估时每个端口可保持多个请求在途
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=256, limit_per_host=64, keepalive_timeout=75, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=600),
+            read_bufsize=4 * 1024 * 1024  # embedding响应体较大，加大读缓冲减少拷贝次数
+        )
+        _async_sessions[loop] = session
+    return session
+
+async def aclose_sessions():
+    """关闭当前事件循环上的aiohttp会话。
+    asyncio.run返回时事件循环已关闭，atexit中无法再await，入口脚本应在返回前调用（见closing_sessions）"""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+async def closing_sessions(coro):
+    """运行入口协程，结束（包括异常）时关闭本事件循环上的会话：asyncio.run(closing_sessions(main()))"""
+    try:
+        return await coro
+    finally:
+        await aclose_sessions()
+
+@atexit.register
+def _close_async_sessions():
+    """进程退出时的兜底：关闭入口脚本没有关闭的会话"""
+    for loop, session in list(_async_sessions.items()):
+        if session.closed:
+            continue
+        if not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(session.close())
+        else:
+            # 事件循环已关闭，无法再await：同步关闭连接器（底层连接已随循环失效），避免"Unclosed client session"告警
+            with contextlib.suppress(Exception):
+                session.connector.close()
+    _async_sessions.clear()
+
+def get_oss_ports() -> List[str]:
+    """获取OSS服务端口列表"""
     oss_ports = os.getenv("OSS_PORTS", "30066")
     
     # 解析端口列表
     if "," in oss_ports:
-        ports_list = [port.strip() for port in oss_ports.split(",")]
-    else:
-        ports_list = [oss_ports]
-    
-    # 轮询选择端口
-    with _oss_lock:
-        port = ports_list[_oss_counter % len(ports_list)]
-        _oss_counter += 1
-    
+        return [port.strip() for port in oss_ports.split(",")]
+    return [oss_ports]
+
+def _build_oss_config(oss_host: str, port: str) -> Dict[str, Any]:
+    """构造指定端口的OSS配置"""
     return {
         "url": f"http://{oss_host}:{port}/v1/chat/completions",
         "headers": {
@@ -59,33 +206,62 @@ def get_oss_config():
         "host": oss_host
     }
 
-def get_embedding_config():
-    """获取Embedding配置，支持多端口负载均衡"""
-    global _embedding_counter
+def get_oss_config(port: str = None):
+    """获取OSS配置，支持多端口负载均衡（指定port时直接使用该端口）。返回的配置按端口复用，调用方不要修改"""
+    global _oss_rotation
     
     # 从环境变量读取配置
-    embedding_host = os.getenv("EMBEDDING_HOST", "10.0.4.178")
+    oss_host = os.getenv("OSS_HOST", "10.0.4.178")
+    env_key = (oss_host, os.getenv("OSS_PORTS", "30066"))
+    
+    rotation = _oss_rotation
+    if rotation is None or rotation[0] != env_key:
+        ports_list = get_oss_ports()
+        rotation = (env_key, itertools.cycle(ports_list), {p: _build_oss_config(oss_host, p) for p in ports_list})
+        _oss_rotation = rotation
+    
+    # 轮询选择端口：对cycle的一次next()在GIL下是原子的，无需加锁
+    if port is None:
+        port = next(rotation[1])
+    
+    config = rotation[2].get(port)
+    return config if config is not None else _build_oss_config(oss_host, port)
+
+def get_embedding_ports() -> List[str]:
+    """获取远程Embedding服务端口列表"""
     embedding_ports = os.getenv("EMBEDDING_PORTS", "30151")
     
     # 解析端口列表
     if "," in embedding_ports:
-        ports_list = [port.strip() for port in embedding_ports.split(",")]
-    else:
-        ports_list = [embedding_ports]
+        return [port.strip() for port in embedding_ports.split(",")]
+    return [embedding_ports]
+
+def get_embedding_config():
+    """获取Embedding配置，支持多端口负载均衡。返回的配置按端口复用，调用方不要修改"""
+    global _embedding_rotation
     
-    # 轮询选择端口
-    with _embedding_lock:
-        port = ports_list[_embedding_counter % len(ports_list)]
-        _embedding_counter += 1
+    # 从环境变量读取配置
+    embedding_host = os.getenv("EMBEDDING_HOST", "10.0.4.178")
+    env_key = (embedding_host, os.getenv("EMBEDDING_PORTS", "30151"))
     
-    return {
-        "url": f"http://{embedding_host}:{port}/v1/embeddings",
-        "headers": {
-            "Content-Type": "application/json"
-        },
-        "port": port,
-        "host": embedding_host
-    }
+    rotation = _embedding_rotation
+    if rotation is None or rotation[0] != env_key:
+        configs = [
+            {
+                "url": f"http://{embedding_host}:{port}/v1/embeddings",
+                "headers": {
+                    "Content-Type": "application/json"
+                },
+                "port": port,
+                "host": embedding_host
+            }
+            for port in get_embedding_ports()
+        ]
+        rotation = (env_key, itertools.cycle(configs))
+        _embedding_rotation = rotation
+    
+    # 轮询选择端口：对cycle的一次next()在GIL下是原子的，无需加锁
+    return next(rotation[1])
 
 def enable_remote_embedding():
     """启用远程Embedding服务"""
@@ -100,58 +276,282 @@ def disable_remote_embedding():
     print("✅ 已切换到本地Embedding模型")
 
 # ==================== Qwen Embedding 配置 ====================
-QWEN_MODEL_PATH = "/mnt/jfs/xubenfeng/rag/models_and_datasets/Qwen3-Embedding-0.6B"
+# 模型路径(QWEN_MODEL_PATH)、长度分桶(LENGTH_BUCKETS)和截断长度(MAX_LENGTH)与embedding_server共用，见embedding_common
+LOCAL_SUB_BATCH = 32  # 本地单次前向的最大文本数
+# GPU上默认编译模型前向，TORCH_COMPILE=0关闭
+_TORCH_COMPILE = os.getenv("TORCH_COMPILE", "1") == "1"
+# 编译模式下的批大小档位（序列维按LENGTH_BUCKETS分档），所有形状在加载时预热
+_LOCAL_BATCH_SIZES = batch_size_steps(LOCAL_SUB_BATCH)
+# EMBED_QUANT=int8时本地模型以INT8权重加载（torch路径；ONNX路径见export脚本的--int8）
+_EMBED_INT8 = os.getenv("EMBED_QUANT", "").lower() == "int8"
+_model_compiled = False
 
 # 全局变量存储模型
 _tokenizer = None
 _model = None
+_init_lock = threading.Lock()
 _device = None
+_dtype = None
+_hidden_size = None
+_ort_session = None  # 设置ORT_EMBED_PATH时改用ONNX Runtime推理（见export_qwen_embedding_onnx.py）
+
+# 允许FP32矩阵乘使用TF32（模型中显式以FP32计算的部分也能走tensor core）
+torch.set_float32_matmul_precision("high")
+
+# 按文本内容哈希缓存embedding，本地和远程共用（LRU，超出上限时淘汰最久未用的条目；设为0关闭缓存）
+_EMBED_CACHE_MAX = int(os.getenv("EMBED_CACHE_MAX", "100000"))
+_embed_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_embed_cache_lock = threading.RLock()
+
+class DiskEmbeddingCache:
+    """持久化的embedding缓存（SQLite），进程重启后已编码过的文本直接命中。
+    
+    读在调用线程中进行（共享一个连接，加锁）；写入经队列交给单个写线程批量提交，不阻塞编码路径"""
+    
+    _SELECT_CHUNK = 500  # 单条SQL的参数个数上限（老版本SQLite限制为999）
+    
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        self._conn = self._connect()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS e (k BLOB PRIMARY KEY, v BLOB)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="embedding-disk-cache", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """批量读取，返回命中的 键->向量"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._SELECT_CHUNK):
+                chunk = keys[start:start + self._SELECT_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT k, v FROM e WHERE k IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for key, value in rows:
+                    found[key] = np.frombuffer(value, dtype=np.float32)
+        return found
+    
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """异步写入（由写线程提交）"""
+        self._writes.put([(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in zip(keys, vectors)])
+    
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            rows = self._writes.get()
+            if rows is None:
+                break
+            # 把队列里已积压的写入合并成一个事务
+            stop = False
+            while not self._writes.empty():
+                more = self._writes.get_nowait()
+                if more is None:
+                    stop = True
+                    break
+                rows.extend(more)
+            conn.executemany("INSERT OR REPLACE INTO e (k, v) VALUES (?, ?)", rows)
+            conn.commit()
+            if stop:
+                break
+        conn.close()
+    
+    def close(self):
+        """等待未完成的写入落盘"""
+        if self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join()
+
+# 设置EMBED_DISK_CACHE=<sqlite文件路径>时启用磁盘缓存；键中带有模型/后端标签（见_embed_model_tag），不同模型可共用同一文件
+_EMBED_DISK_CACHE_PATH = os.getenv("EMBED_DISK_CACHE")
+_disk_cache = DiskEmbeddingCache(_EMBED_DISK_CACHE_PATH) if _EMBED_DISK_CACHE_PATH else None
+
+def _embed_cache_lookup(keys: List[bytes]) -> List[Any]:
+    """批量查询缓存（先内存、再磁盘），未命中的位置为None"""
+    with _embed_cache_lock:
+        cached = []
+        for key in keys:
+            vector = _embed_cache.get(key)
+            if vector is not None:
+                _embed_cache.move_to_end(key)
+            cached.append(vector)
+    
+    if _disk_cache is not None:
+        miss_idx = [i for i, vector in enumerate(cached) if vector is None]
+        if miss_idx:
+            found = _disk_cache.get_many([keys[i] for i in miss_idx])
+            if found:
+                for i in miss_idx:
+                    cached[i] = found.get(keys[i])
+                _embed_cache_remember(list(found), list(found.values()))
+    return cached
+
+def _embed_cache_remember(keys: List[bytes], vectors):
+    """写入内存缓存并淘汰超出上限的旧条目"""
+    if _EMBED_CACHE_MAX <= 0:
+        return
+    with _embed_cache_lock:
+        for key, vector in zip(keys, vectors):
+            # 复制一行，避免缓存持有整个批次数组的引用
+            _embed_cache[key] = vector.copy()
+            _embed_cache.move_to_end(key)
+        while len(_embed_cache) > _EMBED_CACHE_MAX:
+            _embed_cache.popitem(last=False)
+
+def _embed_cache_store(keys: List[bytes], vectors: np.ndarray):
+    """新算出的向量写入内存缓存，启用磁盘缓存时同时持久化"""
+    _embed_cache_remember(keys, vectors)
+    if _disk_cache is not None:
+        _disk_cache.put_many(keys, vectors)
+
+# 只保留这些参数，这些是OpenAI API可能需要的
+_ALLOWED_API_PARAMS = frozenset({
+    'temperature', 'max_tokens', 'top_p', 'frequency_penalty', 
+    'presence_penalty', 'stop', 'stream', 'logit_bias', 'user',
+    'seed', 'top_logprobs', 'logprobs'
+})
+
+# 可以直接放进请求体的值类型；list/dict不试序列化，嵌套内容不合法时由请求时的json编码报错
+_JSON_VALUE_TYPES = (str, int, float, bool, type(None), list, dict)
 
 def filter_json_serializable_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
     """过滤出可以JSON序列化的参数"""
-    filtered_kwargs = {}
+    if not kwargs:
+        return {}
     
-    # 只保留这些类型的参数，这些是OpenAI API可能需要的
-    allowed_params = {
-        'temperature', 'max_tokens', 'top_p', 'frequency_penalty', 
-        'presence_penalty', 'stop', 'stream', 'logit_bias', 'user',
-        'seed', 'top_logprobs', 'logprobs'
+    # 大多数调用只带少数几个参数：一次frozenset查找 + 一次isinstance
+    return {
+        key: value for key, value in kwargs.items()
+        if key in _ALLOWED_API_PARAMS and isinstance(value, _JSON_VALUE_TYPES)
     }
-    
-    for key, value in kwargs.items():
-        # 只处理允许的参数名
-        if key not in allowed_params:
-            # print(f"🔧 跳过非API参数: {key} = {type(value)}")
-            continue
-            
-        # 检查值的类型
-        if isinstance(value, (str, int, float, bool, type(None))):
-            filtered_kwargs[key] = value
-        elif isinstance(value, (list, dict)):
-            try:
-                # 尝试序列化复杂类型
-                json.dumps(value)
-                filtered_kwargs[key] = value
-            except (TypeError, ValueError):
-                print(f"🔧 跳过不能序列化的参数: {key} = {type(value)}")
-        else:
-            print(f"🔧 跳过不支持的类型: {key} = {type(value)}")
-    
-    return filtered_kwargs
+
+def _ort_embed(input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """ONNX Runtime前向 + NumPy上的mask mean pooling和L2归一化"""
+    hidden = _ort_session.run(None, {
+        "input_ids": input_ids.astype(np.int64),
+        "attention_mask": attention_mask.astype(np.int64)
+    })[0].astype(np.float32)
+    weights = attention_mask.astype(np.float32)
+    weights /= np.maximum(weights.sum(axis=1, keepdims=True), 1)
+    pooled = np.einsum("bl,blh->bh", weights, hidden)
+    return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
 
 def init_qwen_embedding():
-    """初始化Qwen Embedding模型"""
-    global _tokenizer, _model, _device
+    """初始化Qwen Embedding模型（线程安全，只加载一次）"""
+    global _tokenizer, _model, _device, _dtype, _hidden_size, _ort_session, _model_compiled
     
-    if _tokenizer is None:
-        print("正在加载Qwen3-Embedding-0.6B模型...")
-        _tokenizer = AutoTokenizer.from_pretrained(QWEN_MODEL_PATH, trust_remote_code=True)
-        _model = AutoModel.from_pretrained(QWEN_MODEL_PATH, trust_remote_code=True)
-        _model.eval()
+    if _tokenizer is not None:
+        return
+    
+    # 本地编码在多个执行器线程中进行：加锁后再检查一次，保证只有一个线程加载模型。
+    # 其余调用方以_tokenizer判断是否已初始化，所以_tokenizer在所有状态就绪后最后赋值
+    with _init_lock:
+        if _tokenizer is not None:
+            return
+        
+        ort_path = os.getenv("ORT_EMBED_PATH")
+        if ort_path:
+            import onnxruntime as ort
+            
+            print(f"正在加载Qwen3-Embedding ONNX模型: {ort_path}")
+            _ort_session = ort.InferenceSession(
+                ort_path,
+                providers=[("CUDAExecutionProvider", {"device_id": 0}), "CPUExecutionProvider"]
+            )
+            _hidden_size = AutoConfig.from_pretrained(QWEN_MODEL_PATH, trust_remote_code=True).hidden_size
+            _tokenizer = AutoTokenizer.from_pretrained(QWEN_MODEL_PATH, trust_remote_code=True)
+            print(f"✅ Qwen Embedding ONNX模型加载完成! Providers: {_ort_session.get_providers()}")
+            return
         
+        print("正在加载Qwen3-Embedding-0.6B模型...")
         _device = "cuda" if torch.cuda.is_available() else "cpu"
-        _model = _model.to(_device)
-        print(f"✅ Qwen Embedding模型加载完成! 设备: {_device}")
+        _dtype = select_dtype(_device)
+        
+        tokenizer = AutoTokenizer.from_pretrained(QWEN_MODEL_PATH, trust_remote_code=True)
+        if _EMBED_INT8 and _device == "cuda":
+            # GPU：bitsandbytes LLM.int8()加载，线性层权重以INT8存放，显存和带宽减半
+            from transformers import BitsAndBytesConfig
+            
+            model = AutoModel.from_pretrained(
+                QWEN_MODEL_PATH,
+                torch_dtype=_dtype,
+                quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                device_map={"": 0},
+                trust_remote_code=True
+            ).eval()
+        else:
+            model = AutoModel.from_pretrained(QWEN_MODEL_PATH, torch_dtype=_dtype, trust_remote_code=True)
+            model = model.to(_device).eval()
+            if _EMBED_INT8:
+                # CPU：bitsandbytes的8bit只支持CUDA，改用PyTorch动态量化（Linear权重INT8，走fbgemm/VNNI）
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        _hidden_size = model.config.hidden_size
+        
+        # GPU上默认用TorchInductor编译前向（算子融合，TORCH_COMPILE=0关闭）。
+        # 本地编码会在多个线程中执行，不用依赖CUDA Graph的reduce-overhead模式。
+        # 按静态形状编译：序列维pad到桶的上限长度，批大小pad到档位，
+        # 形状只有 len(LENGTH_BUCKETS) x len(_LOCAL_BATCH_SIZES) 种，加载时全部预热，编码期间不再重新编译。
+        # INT8量化后的线性层是自定义算子，不做编译
+        if _TORCH_COMPILE and _device == "cuda" and hasattr(torch, "compile") and not _EMBED_INT8:
+            print("⚙️ 编译模型前向 (torch.compile)...")
+            ensure_recompile_limit(len(LENGTH_BUCKETS) * len(_LOCAL_BATCH_SIZES))
+            model = torch.compile(model, fullgraph=False, dynamic=False)
+            _warmup_compiled(model, tokenizer.pad_token_id or 0)
+            _model_compiled = True
+        _model = model
+        _tokenizer = tokenizer
+        print(f"✅ Qwen Embedding模型加载完成! 设备: {_device}, 精度: {_dtype}"
+              + (", 权重: INT8" if _EMBED_INT8 else ""))
+
+def _warmup_compiled(model, pad_token_id: int):
+    """对每个(长度桶, 批大小档位)形状跑一次前向，提前触发编译（与_encode_local相同的autocast设置）"""
+    print(f"🔥 预热编译形状: {len(LENGTH_BUCKETS)} 个长度桶 x {len(_LOCAL_BATCH_SIZES)} 个批大小档位")
+    for bucket in LENGTH_BUCKETS:
+        for batch in _LOCAL_BATCH_SIZES:
+            input_ids = torch.full((batch, bucket), pad_token_id, dtype=torch.long, device=_device)
+            attention_mask = torch.ones_like(input_ids)
+            with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=_dtype):
+                model(input_ids=input_ids, attention_mask=attention_mask)
+    torch.cuda.synchronize()
+
+@functools.lru_cache(maxsize=64)
+def _messages_prefix(system_prompt, history) -> bytes:
+    """系统提示 + 历史消息序列化后的JSON数组前缀（不含结尾的']'）。
+    LightRAG的系统提示模板较长且反复出现，缓存后每次调用只需哈希查找和一次字节拼接"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.extend(dict(message) for message in history)
+    return json_dumps(messages)[:-1]
+
+def _chat_request_body(data: Dict[str, Any], system_prompt, history_messages, prompt) -> bytes:
+    """拼出/v1/chat/completions的请求体：data的字段 + messages"""
+    user_message = json_dumps({"role": "user", "content": prompt})
+    try:
+        history = tuple(tuple(message.items()) for message in history_messages)
+        prefix = _messages_prefix(system_prompt, history)
+    except TypeError:
+        # 历史消息里有不可哈希的内容（如多模态content列表），不走缓存
+        return json_dumps({**data, "messages": [
+            *([{"role": "system", "content": system_prompt}] if system_prompt else []),
+            *history_messages,
+            {"role": "user", "content": prompt}
+        ]})
+    
+    messages = prefix + (b"," if len(prefix) > 1 else b"") + user_message + b"]"
+    return json_dumps(data)[:-1] + b',"messages":' + messages + b"}"
 
 def oss_llm_complete(
     prompt, 
@@ -168,42 +568,32 @@ def oss_llm_complete(
     # 获取负载均衡的配置
     oss_config = get_oss_config()
     
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    
-    # 添加历史消息
-    messages.extend(history_messages)
-    messages.append({"role": "user", "content": prompt})
-    
     # 过滤可序列化的kwargs
     filtered_kwargs = filter_json_serializable_kwargs(kwargs)
     
     data = {
         "model": oss_config["model"],
-        "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature,
         **filtered_kwargs
     }
     
     try:
-        response = requests.post(
+        # messages（系统提示 + 历史消息 + 用户消息）单独序列化，前缀部分有缓存
+        body = _chat_request_body(data, system_prompt, history_messages, prompt)
+        response = _session().post(
             oss_config["url"], 
             headers=oss_config["headers"], 
-            json=data, 
+            data=body, 
             timeout=60
         )
         
         if response.status_code == 200:
-            result = response.json()
+            result = json_loads(response.content)
             content = result["choices"][0]["message"]["content"]
             
             # 处理thinking模式的输出
-            if "analysis" in content and "assistantfinal" in content:
-                assistantfinal_start = content.find("assistantfinal")
-                if assistantfinal_start != -1:
-                    content = content[assistantfinal_start:].replace("assistantfinal", "").strip()
+            content = _strip_thinking(content)
             
             # 输出负载均衡信息（可选，调试时使用）
             # print(f"🔄 使用OSS服务: {oss_config['host']}:{oss_config['port']}")
@@ -235,63 +625,59 @@ async def oss_llm_complete_async(
     model="default",
     max_tokens=8192,
     temperature=0.7,
+    port=None,
     **kwargs
 ) -> str:
     """
-    OSS LLM异步调用函数，支持负载均衡
+    OSS LLM异步调用函数，支持负载均衡（传入port时固定发往该端口）
     """
     # 获取负载均衡的配置
-    oss_config = get_oss_config()
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    
-    messages.extend(history_messages)
-    messages.append({"role": "user", "content": prompt})
+    oss_config = get_oss_config(port)
     
     # 过滤可序列化的kwargs
     filtered_kwargs = filter_json_serializable_kwargs(kwargs)
+    stream = bool(filtered_kwargs.pop("stream", _OSS_STREAM))
     
     data = {
         "model": oss_config["model"],
-        "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature,
+        "stream": stream,
         **filtered_kwargs
     }
     
     try:
-        # 创建连接器，限制并发连接数
-        connector = aiohttp.TCPConnector(limit=10, limit_per_host=5)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.post(
-                oss_config["url"], 
-                headers=oss_config["headers"], 
-                json=data,
-                timeout=aiohttp.ClientTimeout(total=600)  # 增加超时时间
-            ) as response:
-                
-                if response.status == 200:
-                    result = await response.json()
+        # messages（系统提示 + 历史消息 + 用户消息）单独序列化，前缀部分有缓存
+        body = _chat_request_body(data, system_prompt, history_messages, prompt)
+        session = _get_async_session()
+        async with session.post(
+            oss_config["url"], 
+            headers=oss_config["headers"], 
+            data=body,
+            timeout=aiohttp.ClientTimeout(total=600)  # 增加超时时间
+        ) as response:
+            
+            if response.status == 200:
+                if stream:
+                    # 流式读取，推理部分边收边丢弃
+                    content = await _read_stream_content(response)
+                else:
+                    result = json_loads(await response.read())
                     content = result["choices"][0]["message"]["content"]
                     
                     # 处理thinking模式的输出
-                    if "analysis" in content and "assistantfinal" in content:
-                        assistantfinal_start = content.find("assistantfinal")
-                        if assistantfinal_start != -1:
-                            content = content[assistantfinal_start:].replace("assistantfinal", "").strip()
-                    
-                    # 输出负载均衡信息（可选，调试时使用）
-                    # print(f"🔄 使用OSS服务: {oss_config['host']}:{oss_config['port']}")
-                    
-                    return content
-                else:
-                    error_text = await response.text()
-                    print(f"❌ OSS API请求失败! 服务: {oss_config['host']}:{oss_config['port']}, 状态码: {response.status}")
-                    print(f"错误信息: {error_text}")
-                    return f"Error: {response.status} - {error_text}"
-                    
+                    content = _strip_thinking(content)
+                
+                # 输出负载均衡信息（可选，调试时使用）
+                # print(f"🔄 使用OSS服务: {oss_config['host']}:{oss_config['port']}")
+                
+                return content
+            else:
+                error_text = await response.text()
+                print(f"❌ OSS API请求失败! 服务: {oss_config['host']}:{oss_config['port']}, 状态码: {response.status}")
+                print(f"错误信息: {error_text}")
+                return f"Error: {response.status} - {error_text}"
+                
     except asyncio.TimeoutError:
         print(f"⏰ OSS API超时: 服务: {oss_config['host']}:{oss_config['port']} (120秒)")
         return "Error: Timeout after 120 seconds"
@@ -304,6 +690,17 @@ async def oss_llm_complete_async(
 
 # ==================== 远程Embedding调用函数 ====================
 
+def _embeddings_from_response(result: Dict[str, Any]) -> np.ndarray:
+    """把/v1/embeddings的响应逐行写入预分配的float32数组，不再先拼一个嵌套list再整体转换"""
+    data = result["data"]
+    if not data:
+        return np.empty((0, 0), dtype=np.float32)
+    
+    embeddings = np.empty((len(data), len(data[0]["embedding"])), dtype=np.float32)
+    for i, item in enumerate(data):
+        embeddings[i] = item["embedding"]
+    return embeddings
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=1, max=5),
@@ -324,28 +721,22 @@ async def remote_embedding_async(texts: List[str]) -> np.ndarray:
     }
     
     try:
-        # 创建连接器，限制并发连接数
-        connector = aiohttp.TCPConnector(limit=20, limit_per_host=10)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.post(
-                embedding_config["url"],
-                headers=embedding_config["headers"],
-                json=data,
-                timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
+        session = _get_async_session()
+        async with session.post(
+            embedding_config["url"],
+            headers=embedding_config["headers"],
+            data=json_dumps(data),
+            timeout=aiohttp.ClientTimeout(total=60)
+        ) as response:
+            
+            if response.status == 200:
+                return _embeddings_from_response(json_loads(await response.read()))
+            else:
+                error_text = await response.text()
+                print(f"❌ Embedding API请求失败! 服务: {embedding_config['host']}:{embedding_config['port']}, 状态码: {response.status}")
+                print(f"错误信息: {error_text}")
+                raise RuntimeError(f"Embedding API Error: {response.status} - {error_text}")
                 
-                if response.status == 200:
-                    result = await response.json()
-                    embeddings = []
-                    for item in result["data"]:
-                        embeddings.append(item["embedding"])
-                    return np.array(embeddings, dtype=np.float32)
-                else:
-                    error_text = await response.text()
-                    print(f"❌ Embedding API请求失败! 服务: {embedding_config['host']}:{embedding_config['port']}, 状态码: {response.status}")
-                    print(f"错误信息: {error_text}")
-                    raise RuntimeError(f"Embedding API Error: {response.status} - {error_text}")
-                    
     except asyncio.TimeoutError:
         print(f"⏰ Embedding API超时: 服务: {embedding_config['host']}:{embedding_config['port']} (60秒)")
         raise
@@ -366,19 +757,15 @@ def remote_embedding(texts: List[str]) -> np.ndarray:
     }
     
     try:
-        response = requests.post(
+        response = _retrying_session().post(
             embedding_config["url"],
             headers=embedding_config["headers"],
-            json=data,
+            data=json_dumps(data),
             timeout=60
         )
         
         if response.status_code == 200:
-            result = response.json()
-            embeddings = []
-            for item in result["data"]:
-                embeddings.append(item["embedding"])
-            return np.array(embeddings, dtype=np.float32)
+            return _embeddings_from_response(json_loads(response.content))
         else:
             print(f"❌ Embedding API请求失败! 服务: {embedding_config['host']}:{embedding_config['port']}, 状态码: {response.status_code}")
             print(f"错误信息: {response.text}")
@@ -388,57 +775,224 @@ def remote_embedding(texts: List[str]) -> np.ndarray:
         print(f"❌ Embedding API调用异常: 服务: {embedding_config['host']}:{embedding_config['port']}, 错误: {e}")
         raise e
 
-def qwen_embedding(texts: List[str]) -> np.ndarray:
-    """
-    Qwen Embedding同步调用函数 - 支持远程/本地切换
-    """
-    global _use_remote_embedding, _tokenizer, _model, _device
+def _encode_local(texts: List[str]) -> np.ndarray:
+    """用本地模型编码文本（不经过缓存）。按token长度排序分桶，每个子批次只pad到桶内最长序列"""
+    # 先不pad地tokenize，拿到每条文本的长度
+    encoded = _tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+    input_ids = encoded["input_ids"]
+    attention_mask = encoded["attention_mask"]
     
-    # 如果启用了远程服务，使用远程调用
-    if _use_remote_embedding:
-        return remote_embedding(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+    embeddings = np.empty((len(texts), _hidden_size), dtype=np.float32)
     
-    # 本地模式：确保模型已加载
-    if _tokenizer is None:
-        init_qwen_embedding()
+    # GPU上再套一层autocast，remote code中没有随权重转换精度的FP32张量参与的矩阵乘也按半精度执行
+    amp = torch.autocast(device_type="cuda", dtype=_dtype) if _device == "cuda" else contextlib.nullcontext()
     
-    try:
-        # Tokenize输入文本
-        inputs = _tokenizer(
-            texts, 
-            padding=True, 
-            truncation=True, 
-            return_tensors="pt", 
-            max_length=512
-        )
-        inputs = {k: v.to(_device) for k, v in inputs.items()}
+    start = 0
+    while start < len(order):
+        # 当前子批次：长度上限相同且不超过LOCAL_SUB_BATCH条的一段连续序列
+        bucket = next(b for b in LENGTH_BUCKETS if len(input_ids[order[start]]) <= b)
+        end = start
+        while (end < len(order) and end - start < LOCAL_SUB_BATCH
+               and len(input_ids[order[end]]) <= bucket):
+            end += 1
+        indices = order[start:end]
+        
+        batch = {
+            "input_ids": [input_ids[i] for i in indices],
+            "attention_mask": [attention_mask[i] for i in indices]
+        }
+        if _ort_session is not None:
+            inputs = _tokenizer.pad(batch, padding="longest", return_tensors="np")
+            embeddings[indices] = _ort_embed(inputs["input_ids"], inputs["attention_mask"])
+            start = end
+            continue
+        
+        # 编译后序列维pad到桶的上限长度、批大小pad到档位，只会遇到预热过的形状
+        if _model_compiled:
+            inputs = _tokenizer.pad(batch, padding="max_length", max_length=bucket, return_tensors="pt")
+            inputs = pad_rows(inputs, _LOCAL_BATCH_SIZES, _tokenizer.pad_token_id or 0)
+        else:
+            inputs = _tokenizer.pad(batch, padding="longest", return_tensors="pt")
+        if _device == "cuda":
+            # 锁页内存 + non_blocking：H2D拷贝异步提交，不阻塞后续kernel的下发
+            inputs = {k: v.pin_memory().to(_device, non_blocking=True) for k, v in inputs.items()}
+        else:
+            inputs = {k: v.to(_device) for k, v in inputs.items()}
         
         # 生成embeddings
-        with torch.no_grad():
+        with torch.inference_mode(), amp:
             outputs = _model(**inputs)
-            # 使用mean pooling
-            embeddings = outputs.last_hidden_state.mean(dim=1)
-            embeddings = embeddings.cpu().numpy()
-        
-        return embeddings
+            # 使用mean pooling（忽略padding），并做L2归一化
+            pooled = masked_mean_pool(outputs.last_hidden_state, inputs["attention_mask"])
+            pooled = torch.nn.functional.normalize(pooled[:len(indices)], p=2, dim=1)
+        embeddings[indices] = pooled.cpu().numpy()
         
+        start = end
+    
+    return embeddings
+
+def _embed_local(texts: List[str]) -> np.ndarray:
+    """本地模型编码（确保模型已加载）"""
+    if _tokenizer is None:
+        init_qwen_embedding()
+    
+    try:
+        return _encode_local(texts)
     except Exception as e:
         print(f"❌ Qwen Embedding生成失败: {e}")
         raise e
 
+@functools.lru_cache(maxsize=1)
+def _local_model_tag() -> str:
+    """本地编码后端的标签：ONNX模型路径，或模型路径 + 推理精度 + 是否INT8"""
+    ort_path = os.getenv("ORT_EMBED_PATH")
+    if ort_path:
+        return f"ort:{ort_path}"
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return f"torch:{QWEN_MODEL_PATH}:{select_dtype(device)}" + (":int8" if _EMBED_INT8 else "")
+
+def _embed_model_tag() -> str:
+    """当前embedding来源的标签，加入缓存键：本地/远程可在运行时切换，每次调用时重新取"""
+    if _use_remote_embedding:
+        return f"remote:{os.getenv('EMBEDDING_HOST', '10.0.4.178')}:{os.getenv('EMBEDDING_PORTS', '30151')}"
+    return _local_model_tag()
+
+def _embed_cache_split(texts: List[str]):
+    """查缓存：返回每条文本的键、已命中的向量（未命中为None）以及需要编码的下标（已去重）。
+    键由模型/后端标签和文本共同决定，切换后端或模型后不会读到其他模型算出的向量"""
+    tag = _embed_model_tag()
+    keys = [text_key(f"{tag}\0{text}") for text in texts]
+    embeddings = _embed_cache_lookup(keys)
+    return keys, embeddings, unique_misses(keys, embeddings)
+
+def _embed_cache_fill(keys: List[bytes], embeddings: list, miss_idx: List[int], computed: np.ndarray) -> np.ndarray:
+    """把新算出的向量写入缓存，并按原顺序拼回完整结果"""
+    if miss_idx:
+        _embed_cache_store([keys[i] for i in miss_idx], computed)
+        # 按键回填，批内重复的文本共用同一个结果
+        computed_by_key = {keys[i]: computed[j] for j, i in enumerate(miss_idx)}
+        for i, vector in enumerate(embeddings):
+            if vector is None:
+                embeddings[i] = computed_by_key[keys[i]]
+    
+    if not embeddings:
+        return np.empty((0, _hidden_size or 0), dtype=np.float32)
+    return np.stack(embeddings)
+
+def qwen_embedding(texts: List[str]) -> np.ndarray:
+    """
+    Qwen Embedding同步调用函数 - 支持远程/本地切换
+    """
+    global _use_remote_embedding
+    
+    # 先查缓存，只对未命中的文本调用远程服务或本地模型，再按原顺序拼回
+    keys, embeddings, miss_idx = _embed_cache_split(texts)
+    computed = None
+    if miss_idx:
+        misses = [texts[i] for i in miss_idx]
+        computed = remote_embedding(misses) if _use_remote_embedding else _embed_local(misses)
+    return _embed_cache_fill(keys, embeddings, miss_idx, computed)
+
+# 异步embedding：并发的小调用在一个短时间窗口内合并成一批再编码
+_EMBED_BATCH_MAX = 64        # 合并后单次编码的最大文本数
+_EMBED_BATCH_WAIT = 0.005    # 合并并发调用的等待窗口（秒）
+# 本地编码在专用线程池中执行，不占用默认executor。线程数按GPU并发度设置：
+# 默认2，一批在GPU上前向时，下一批可以同时在另一个线程里做tokenize（快速tokenizer会释放GIL）
+_EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+_embed_executor = ThreadPoolExecutor(max_workers=_EMBED_WORKERS, thread_name_prefix="qwen-embedding")
+
+class EmbeddingBatcher:
+    """把同一事件循环中并发的embedding调用合并成一次编码（本地前向或一次远程POST）"""
+    
+    def __init__(self, encode, max_inflight: int = 1,
+                 max_batch: int = _EMBED_BATCH_MAX, max_wait: float = _EMBED_BATCH_WAIT):
+        self._encode = encode              # async (texts) -> np.ndarray
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._pending = deque()
+        self._flush_task = None
+        self._running = set()
+    
+    async def submit(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texts, future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        return await future
+    
+    async def _flush(self):
+        """等待一个时间窗口收集请求，然后逐批提交；等待空闲槽位期间到达的请求并入下一批"""
+        await asyncio.sleep(self.max_wait)
+        
+        while self._pending:
+            await self._slots.acquire()
+            batch = [self._pending.popleft()]
+            total = len(batch[0][0])
+            while self._pending and total + len(self._pending[0][0]) <= self.max_batch:
+                batch.append(self._pending.popleft())
+                total += len(batch[-1][0])
+            
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        
+        self._flush_task = None
+    
+    async def _run(self, batch):
+        """编码一批文本，再按调用方拆分结果"""
+        try:
+            embeddings = await self._encode([text for texts, _ in batch for text in texts])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        
+        offset = 0
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(texts)])
+            offset += len(texts)
+
+async def _encode_local_async(texts: List[str]) -> np.ndarray:
+    """在专用线程中执行本地embedding"""
+    return await asyncio.get_running_loop().run_in_executor(_embed_executor, _embed_local, texts)
+
+_embed_batchers: Dict[Any, EmbeddingBatcher] = {}
+
+def _get_embed_batcher(remote: bool) -> EmbeddingBatcher:
+    """获取当前事件循环的embedding合并器（合并器与创建它的事件循环绑定）"""
+    loop = asyncio.get_running_loop()
+    batcher = _embed_batchers.get((loop, remote))
+    if batcher is None:
+        for stale in [key for key in _embed_batchers if key[0].is_closed()]:
+            del _embed_batchers[stale]
+        if remote:
+            # 远程服务每个端口允许两批同时在途，让多个端口并行工作
+            batcher = EmbeddingBatcher(remote_embedding_async, max_inflight=len(get_embedding_ports()) * 2)
+        else:
+            batcher = EmbeddingBatcher(_encode_local_async, max_inflight=_EMBED_WORKERS)
+        _embed_batchers[(loop, remote)] = batcher
+    return batcher
+
 async def qwen_embedding_async(texts: List[str]) -> np.ndarray:
     """
     Qwen Embedding异步调用函数 - 支持远程/本地切换
     """
     global _use_remote_embedding
     
-    # 如果启用了远程服务，使用远程异步调用
-    if _use_remote_embedding:
-        return await remote_embedding_async(texts)
-    
-    # 本地模式：异步执行本地embedding
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, qwen_embedding, texts)
+    # 先查缓存；未命中的文本与同一事件循环中的其他并发调用合并后再编码：
+    # 远程模式合并成一次POST，本地模式在专用线程中执行一次前向
+    keys, embeddings, miss_idx = _embed_cache_split(texts)
+    computed = None
+    if miss_idx:
+        computed = await _get_embed_batcher(_use_remote_embedding).submit([texts[i] for i in miss_idx])
+    return _embed_cache_fill(keys, embeddings, miss_idx, computed)
 
 # ==================== LightRAG 兼容函数 ====================
 
@@ -489,11 +1043,34 @@ async def lightrag_embedding_func_async(texts: List[str]) -> np.ndarray:
     return await qwen_embedding_async(texts)
 
 # ==================== 获取Embedding维度 ====================
+_embedding_dim = None
+
+def _remote_embedding_dim():
+    """从远程Embedding服务的/v1/models读取向量维度，读不到时返回None"""
+    embedding_config = get_embedding_config()
+    models_url = embedding_config["url"].rsplit("/", 1)[0] + "/models"
+    try:
+        response = _retrying_session().get(models_url, timeout=10)
+        if response.status_code == 200:
+            return json_loads(response.content)["data"][0].get("dimensions")
+    except Exception as e:
+        print(f"⚠️ 无法从 {models_url} 读取Embedding维度: {e}")
+    return None
+
 def get_embedding_dim() -> int:
-    """获取Embedding维度"""
-    # 用一个测试文本来获取维度
-    test_embedding = qwen_embedding(["test"])
-    return test_embedding.shape[1]
+    """获取Embedding维度（首次调用后缓存）"""
+    global _embedding_dim
+    
+    if _embedding_dim is None:
+        if _use_remote_embedding:
+            # 远程模式本地没有模型：先从/v1/models读服务端上报的维度，旧版服务没有该字段时再用测试文本探测
+            _embedding_dim = _remote_embedding_dim() or qwen_embedding(["test"]).shape[1]
+        else:
+            # 本地模式直接读模型配置，不必跑一次前向
+            if _tokenizer is None:
+                init_qwen_embedding()
+            _embedding_dim = _hidden_size
+    return _embedding_dim
 
 def show_oss_config():
     """显示当前OSS负载均衡配置"""
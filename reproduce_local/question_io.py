@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+问题文件读取
+生成的问题文件每行形如 "- Question N: <问题>"，batch_eval_local 和 analyze_question_quality 共用
+"""
+
+import re
+
+# 预编译的问题提取正则
+QUESTION_RE = re.compile(r"- Question \d+: (.+)")
+
+def iter_questions(path):
+    """逐行读取问题文件，依次产出问题文本（不把整个文件读入内存）"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            m = QUESTION_RE.search(line)
+            if m:
+                yield m.group(1)
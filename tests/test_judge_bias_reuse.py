@@ -0,0 +1,81 @@
+"""
+试次偏置复用位置偏置评判结果的测试
+
+复用模式下，位置偏置测试用单条评判模板评判试次偏置会抽中的答案对，
+试次偏置测试直接把这两次评判作为前两次试验，每对只需再评判一次。
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("aiofiles")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("aiohttp")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reproduce_local"))
+
+import analyze_judge_bias  # noqa: E402
+
+
+class _FakeEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+def _answer_pairs(n):
+    return [
+        {
+            "question": f"问题{i}",
+            "hybrid_answer": f"hybrid答案{i}",
+            "naive_answer": f"naive答案{i}",
+            "hybrid_tokens": 10,
+            "naive_tokens": 10,
+            "length_diff": 0,
+        }
+        for i in range(n)
+    ]
+
+
+def test_trial_bias_consumes_position_verdicts(monkeypatch):
+    monkeypatch.setattr(analyze_judge_bias.tiktoken, "get_encoding", lambda name: _FakeEncoding())
+
+    async def no_sleep(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(analyze_judge_bias.asyncio, "sleep", no_sleep)
+
+    single_calls = []
+
+    async def fake_judge(prompt, **kwargs):
+        if "相互独立的评判任务" in prompt:
+            return json.dumps([{"pair_id": i, "choice": "A"} for i in range(analyze_judge_bias.JUDGE_BATCH_SIZE)])
+        single_calls.append(kwargs)
+        return "选择: A"
+
+    monkeypatch.setattr(analyze_judge_bias, "retrying_judge", fake_judge)
+
+    analyzer = analyze_judge_bias.JudgeBiasAnalyzer(trial_temperature=analyze_judge_bias.JUDGE_TEMPERATURE)
+    assert analyzer.reuses_position_verdicts
+    pairs = _answer_pairs(12)
+
+    asyncio.run(analyzer.test_position_bias_hybrid_naive(pairs))
+    sampled_indices, _ = analyzer._trial_sample(pairs)
+    for answer_idx in sampled_indices:
+        assert (answer_idx, "hybrid_first") in analyzer._position_choices
+        assert (answer_idx, "naive_first") in analyzer._position_choices
+
+    single_calls.clear()
+    results = asyncio.run(analyzer.test_trial_bias_hybrid_naive(pairs))
+
+    assert len(results) == len(sampled_indices)
+    for pair_results in results:
+        cached = [trial["from_position_cache"] for trial in pair_results["trials"]]
+        assert cached == [True, True, False]
+    # 每个抽中的答案对只有第三次试验需要重新评判
+    assert len(single_calls) == len(sampled_indices)